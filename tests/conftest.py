@@ -0,0 +1,29 @@
+import pytest
+
+import vmlab
+from vmlab.models import arch_dev_model
+
+
+@pytest.fixture
+def create_setup():
+    """Factory of setups of the arch_dev_model tree from 2003-06-01
+
+    Inputs default to the seed 11 and are updated with input_vars. The tree (or the list of
+    trees of a forest) defaults to the initial tree of the toml file.
+    """
+
+    def create(output_vars, end_date='2003-12-01', input_vars=None, model=arch_dev_model, tree=None):
+        return vmlab.create_setup(
+            model=model,
+            start_date='2003-06-01',
+            end_date=end_date,
+            setup_toml='arch_dev_model.toml',
+            tree=tree,
+            input_vars={
+                'topology__seed': 11,
+                **(input_vars or {})
+            },
+            output_vars=output_vars
+        )
+
+    return create
@@ -0,0 +1,146 @@
+import os
+import threading
+
+import numpy as np
+import xarray as xr
+import zarr
+
+import pytest
+
+import vmlab
+import vmlab.vmlab
+from vmlab.models import arch_dev_model
+
+_fn_parallel = vmlab.vmlab._fn_parallel
+
+
+def crash_run(id, *args):
+    """Run a job but exit the worker process without cleanup at run 1"""
+    if id == 1:
+        with open(os.environ['VMLAB_TEST_CRASHES'], 'a') as file:
+            file.write('1\n')
+        os._exit(1)
+    return _fn_parallel(id, *args)
+
+
+def test_crashing_run_is_retried_a_limited_number_of_times(tmp_path, monkeypatch, create_setup):
+    crashes = tmp_path / 'crashes'
+    # workers are forked and inherit the patched function and the environment
+    monkeypatch.setenv('VMLAB_TEST_CRASHES', str(crashes))
+    monkeypatch.setattr(vmlab.vmlab, '_fn_parallel', crash_run)
+    setup = create_setup({'topology__nb_gu': None}, end_date='2003-07-01')
+    batch = ('seed', [{'topology__seed': seed} for seed in range(3)])
+    retries = 2
+    with pytest.raises(vmlab.BatchError) as info:
+        vmlab.run(setup, arch_dev_model, batch=batch, nb_proc=2, progress=False, retries=retries)
+    assert 1 in info.value.failures
+    assert len(crashes.read_text().splitlines()) == retries + 1
+
+
+def test_store_pads_indices_and_marks_failed_runs(tmp_path, monkeypatch, create_setup):
+    monkeypatch.setenv('VMLAB_TEST_CRASHES', str(tmp_path / 'crashes'))
+    monkeypatch.setattr(vmlab.vmlab, '_fn_parallel', crash_run)
+    setup = create_setup({'topology__parent': None}, end_date='2003-10-01')
+    batch = ('seed', [{'topology__seed': seed} for seed in range(3)])
+    ds = vmlab.run(
+        setup, arch_dev_model, batch=batch, nb_proc=1, progress=False, retries=0, errors='skip', store=str(tmp_path / 'store.zarr')
+    )
+    status = ds['batch__status'].values
+    assert status[1] == 'failed'
+    parent = ds['topology__parent'].values
+    assert parent.dtype.kind == 'i'
+    for i in np.flatnonzero(status == 'completed'):
+        nb_gu = np.count_nonzero(parent[i] >= 0) + 1
+        # the root and the padding are -1
+        assert np.all(parent[i, nb_gu:] == -1)
+
+
+def test_store_coordinates_of_runs_of_different_lengths(tmp_path):
+    lengths = [348, 386, 376, 360, 390, 352, 370, 381]
+    lock = threading.Lock()
+    for round in range(20):
+        path = str(tmp_path / f'{round}.zarr')
+        zarr.open_group(path, mode='w')
+        barrier = threading.Barrier(len(lengths))
+
+        def write(index, nb_gu):
+            ds = xr.Dataset({'topology__parent': ('GU', np.arange(nb_gu) - 1)}, coords={'GU': np.arange(nb_gu)})
+            barrier.wait()
+            vmlab.vmlab._write_region(path, ds, 'seed', len(lengths), index, lock)
+
+        # the runs write the chunks of their GU coordinate in parallel
+        threads = [threading.Thread(target=write, args=item) for item in enumerate(lengths)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        group = zarr.open_group(path, mode='r')
+        np.testing.assert_array_equal(group['GU'][:], np.arange(max(lengths)))
+        assert group['topology__parent'][0, -1] == -1
+
+
+def test_run_iter_yields_each_run_once(tmp_path, create_setup):
+    output_vars = {'topology__nb_gu': None, 'topology__cycle': 'day'}
+    setup = create_setup(output_vars, end_date='2003-10-01')
+    seeds = [1, 2, 3, 4]
+    batch = ('seed', [{'topology__seed': seed} for seed in seeds])
+    sink = str(tmp_path / 'sink.zarr')
+    outputs = {}
+    for index, ds in vmlab.run_iter(setup, arch_dev_model, batch, progress=False, nb_proc=2, sink=sink):
+        assert index not in outputs
+        outputs[index] = ds
+    assert sorted(outputs) == list(range(len(seeds)))
+    for index, seed in enumerate(seeds):
+        single = vmlab.run(create_setup(output_vars, end_date='2003-10-01', input_vars={'topology__seed': seed}), arch_dev_model, progress=False)
+        xr.testing.assert_identical(outputs[index], single)
+        xr.testing.assert_identical(xr.open_zarr(sink, group=str(index), mask_and_scale=False).load(), outputs[index])
+
+    reduced = dict(vmlab.run_iter(setup, arch_dev_model, batch, progress=False, nb_proc=2, reduce={'topology__nb_gu': 'max'}))
+    assert sorted(reduced) == list(range(len(seeds)))
+    for index, values in reduced.items():
+        assert values == {'topology__nb_gu': float(outputs[index]['topology__nb_gu'])}
+
+
+def worker_pid(data_array):
+    return os.getpid()
+
+
+def test_executor_workers_are_reused(create_setup):
+    setup = create_setup({'topology__nb_gu': None}, end_date='2003-07-01')
+    batch = ('seed', [{'topology__seed': seed} for seed in range(4)])
+    with vmlab.Executor(2) as executor:
+        pids = []
+        pools = []
+        for _ in range(2):
+            results = vmlab.run_iter(setup, arch_dev_model, batch, progress=False, executor=executor, reduce={'topology__nb_gu': worker_pid})
+            pids.append(set(result['topology__nb_gu'] for _, result in results))
+            pools.append(executor._pool)
+        # the second batch runs in the processes of the first one
+        assert pools[1] is pools[0]
+        assert pids[1] <= pids[0]
+        assert os.getpid() not in pids[0]
+
+
+def test_chunks_are_longest_first():
+    estimates = np.array([1., 10., 3., 8., 2., 1.])
+    # about estimates.sum() / 4 per chunk, runs longer than that stay alone
+    chunks = vmlab.vmlab._get_chunks(estimates, 2, 2)
+    assert chunks == [[1], [3], [2, 4, 0, 5]]
+    chunks = vmlab.vmlab._get_chunks(estimates, 6, 1)
+    assert chunks == [[1], [3], [2, 4], [0, 5]]
+
+
+def test_estimates_of_larger_trees_are_longer(create_setup):
+    setup = create_setup({'topology__nb_gu': None}, end_date='2003-07-01')
+    nb_steps = setup['day'].shape[0] - 1
+    nb_gu = setup['topology__parent'].shape[0]
+    batch_runs = [{'topology__seed': 1}, {'topology__parent': np.full(2 * nb_gu, -1)}]
+    executor = vmlab.Executor(1)
+    keys, costs, estimates = executor._estimate(setup, batch_runs)
+    np.testing.assert_array_equal(costs, [nb_gu * nb_steps, 2 * nb_gu * nb_steps])
+    np.testing.assert_array_equal(estimates, costs)
+    assert vmlab.vmlab._get_chunks(estimates, 1, 1) == [[1, 0]]
+    # measured runs take their time, the others are scaled with the seconds per cost
+    executor.timings[keys[0]] = (2., costs[0])
+    keys, costs, estimates = executor._estimate(setup, batch_runs)
+    np.testing.assert_allclose(estimates, [2., 4.])
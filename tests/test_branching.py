@@ -0,0 +1,56 @@
+import pytest
+
+import vmlab
+from vmlab.branching import _reads
+from vmlab.models import arch_dev_model, fruit_model
+
+
+@pytest.fixture
+def setup(create_setup):
+    return create_setup({'topology__current_cycle': 'day'}, end_date='2003-08-15')
+
+
+def test_branches_diverge(setup):
+    branches = [{'topology__month_begin_veg_cycle': 7}, {'topology__month_begin_veg_cycle': 8}]
+    # arch_dev processes read it in initialize as well, for the GUs of the initial tree
+    ds = vmlab.fork(setup, arch_dev_model, '2003-06-15', branches, progress=False, force=True)
+    current_cycle = ds['topology__current_cycle']
+    before, after = current_cycle.sel(day='2003-06-10'), current_cycle.sel(day='2003-07-15')
+    assert before.isel(branch=0) == before.isel(branch=1)
+    assert after.isel(branch=0) == before.isel(branch=0) + 1
+    assert after.isel(branch=1) == before.isel(branch=1)
+
+
+def test_branch_inputs_are_set_once(setup):
+    # current_cycle is an inout variable the model increments after the fork
+    ds = vmlab.fork(setup, arch_dev_model, '2003-06-15', [{'topology__current_cycle': 5}], progress=False, force=True)
+    current_cycle = ds['topology__current_cycle'].isel(branch=0)
+    assert current_cycle.sel(day='2003-06-20') == 5
+    assert current_cycle.sel(day='2003-07-15') == 6
+
+
+def test_inputs_read_in_initialize_only_are_rejected(setup):
+    with pytest.raises(AssertionError):
+        vmlab.fork(setup, arch_dev_model, '2003-06-15', [{'topology__engine': 'lpy'}], progress=False)
+
+
+def test_inputs_read_in_initialize_are_rejected():
+    brancher = vmlab.Brancher(10, [{'carbon_demand__DM_fruit_0': 20.}], 1, progress=False)
+    # carbon_demand__DM_fruit_max is derived from it in initialize
+    with pytest.raises(AssertionError):
+        brancher.check(fruit_model)
+    brancher.check(fruit_model, force=True)
+
+
+class Helper:
+
+    def run_step(self):
+        self._grow()
+
+    def _grow(self):
+        return self.rate
+
+
+def test_reads_in_helper_methods():
+    assert _reads(Helper, 'rate', 'run_step')
+    assert not _reads(Helper, 'rate', 'initialize')
@@ -0,0 +1,27 @@
+import hashlib
+
+import xarray as xr
+
+import vmlab
+from vmlab.cache import _update_file
+from vmlab.models import arch_dev_model
+
+
+def test_cached_output_is_identical_to_run(tmp_path, create_setup):
+    setup = create_setup({'topology__parent': 'day', 'topology__cycle': 'day'}, end_date='2003-09-01')
+    cache = vmlab.ResultCache(str(tmp_path / 'cache'))
+    ds = vmlab.run(setup, arch_dev_model, progress=False, cache=cache)
+    cached = vmlab.run(setup, arch_dev_model, progress=False, cache=cache)
+    assert cache.size() > 0
+    for name in ds.variables:
+        assert cached[name].dtype == ds[name].dtype
+    xr.testing.assert_identical(cached, ds)
+
+
+def test_toml_strings_that_name_a_parent_directory_are_not_hashed(tmp_path):
+    toml_file = tmp_path / 'parameters.toml'
+    toml_file.write_text("title = ''\nroot = '.'\nup = '..'\n")
+    (tmp_path / 'unrelated.csv').write_text('a,b\n')
+    visited = set()
+    _update_file(hashlib.sha256(), toml_file, visited)
+    assert visited == {toml_file.resolve()}
@@ -0,0 +1,29 @@
+import pytest
+import xarray as xr
+
+import vmlab
+from vmlab.models import arch_dev_model
+
+
+def test_resume_rejects_reduced_outputs(tmp_path, create_setup):
+    setup = create_setup({'topology__appeared': ('day', 'cumsum')})
+    vmlab.run(setup, arch_dev_model, progress=False, checkpoint=str(tmp_path), checkpoint_freq=60)
+    with pytest.raises(AssertionError):
+        vmlab.run(setup, arch_dev_model, progress=False, resume_from=str(tmp_path))
+
+
+def test_resume_rejects_delta_outputs(tmp_path, create_setup):
+    setup = create_setup({'topology__cycle': ('day', 'delta')})
+    vmlab.run(setup, arch_dev_model, progress=False, checkpoint=str(tmp_path), checkpoint_freq=60)
+    with pytest.raises(AssertionError):
+        vmlab.run(setup, arch_dev_model, progress=False, resume_from=str(tmp_path))
+
+
+def test_resume_is_identical_to_an_uninterrupted_run(tmp_path, create_setup):
+    setup = create_setup({'topology__parent': None, 'topology__cycle': 'day', 'topology__nb_gu': 'day'})
+    ds = vmlab.run(setup, arch_dev_model, progress=False, checkpoint=str(tmp_path), checkpoint_freq=30)
+    checkpoints = sorted(tmp_path.glob('*.ckpt'))
+    assert len(checkpoints) > 2
+    for resume_from in (tmp_path, checkpoints[len(checkpoints) // 2]):
+        resumed = vmlab.run(setup, arch_dev_model, progress=False, resume_from=str(resume_from))
+        xr.testing.assert_identical(resumed, ds)
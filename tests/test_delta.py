@@ -0,0 +1,16 @@
+import pytest
+import xarray as xr
+
+import vmlab
+from vmlab.models import arch_dev_model
+
+
+@pytest.mark.parametrize('item', [('day', 'delta', 1), ('day', 'delta', 7), ('day', 'delta')])
+def test_deltas_decode_to_recorded_outputs(create_setup, item):
+    # appearance_date is NaT for the GUs of the initial tree
+    names = ('topology__appearance_date', 'topology__cycle')
+    recorded = vmlab.run(create_setup({name: 'day' for name in names}), arch_dev_model, progress=False)
+    ds = vmlab.decode_deltas(vmlab.run(create_setup({name: item for name in names}), arch_dev_model, progress=False))
+    for name in names:
+        assert recorded[name].isnull().any()
+        xr.testing.assert_identical(ds[name].load(), recorded[name])
@@ -0,0 +1,27 @@
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+import vmlab
+from vmlab.models import arch_dev_model
+
+
+def test_forest_outputs_are_split_per_tree(create_setup):
+    path = pathlib.Path(vmlab.__file__).parent / 'data' / 'trees'
+    trees = [pd.read_csv(path / name) for name in ('tree_B10_cycle_030405.csv', 'tree_B12_cycle_030405.csv')]
+    output_vars = {'topology__parent': None, 'topology__cycle': 'day'}
+    ds = vmlab.run(create_setup(output_vars, end_date='2003-09-01', tree=trees), arch_dev_model, progress=False)
+    assert ds.dims['tree'] == len(trees)
+    for index, tree in enumerate(trees):
+        nb_gu_initial = create_setup(output_vars, end_date='2003-09-01', tree=tree)['topology__parent'].shape[0]
+        cycle = ds['topology__cycle'].isel(tree=index, day=0).values
+        assert np.count_nonzero(~np.isnan(cycle)) == nb_gu_initial
+        # GUs of the tree are numbered from 0, the rest of the GU dimension is padding
+        parent = ds['topology__parent'].isel(tree=index).values
+        nb_gu = np.count_nonzero(~np.isnan(parent))
+        assert nb_gu >= nb_gu_initial
+        assert np.all(np.isnan(parent[nb_gu:]))
+        parent = parent[:nb_gu].astype(np.int64)
+        assert np.count_nonzero(parent == -1) == 1
+        assert np.all((parent >= -1) & (parent < nb_gu))
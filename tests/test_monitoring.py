@@ -0,0 +1,37 @@
+import numpy as np
+
+import vmlab
+from vmlab.models import arch_dev_model
+
+
+def test_memory_includes_buffer_capacity(create_setup):
+    setup = create_setup({'topology__nb_gu': None}, end_date='2004-06-01')
+    ds = vmlab.run(setup, arch_dev_model, progress=False, memory='state')
+    nbytes = ds['memory__variable'].sel(variable='topology__parent').max('day').values
+    nb_gu = int(ds['topology__nb_gu'].values)
+    # parent grows in a buffer with spare capacity beyond the last GU
+    assert nbytes > nb_gu * np.dtype(np.int32).itemsize
+
+
+def test_profile_dimensions(create_setup):
+    setup = create_setup({'topology__nb_gu': None}, end_date='2003-07-01')
+    nb_days = setup['day'].shape[0]
+    nb_processes = len(arch_dev_model)
+    expected = {
+        'profile__nb_gu': (('day',), (nb_days,)),
+        'profile__initialize': (('process',), (nb_processes,)),
+        'profile__run_step': (('process', 'day'), (nb_processes, nb_days)),
+        'profile__finalize_step': (('process', 'day'), (nb_processes, nb_days)),
+        'profile__finalize': (('process',), (nb_processes,))
+    }
+    ds = vmlab.run(setup, arch_dev_model, progress=False, profile=True)
+    assert list(ds['process'].values) == list(arch_dev_model)
+    for name, (dims, shape) in expected.items():
+        assert (ds[name].dims, ds[name].shape) == (dims, shape)
+    # the last day has no step
+    assert np.all(ds['profile__run_step'].isel(day=slice(None, -1)) >= 0)
+
+    batch = ('seed', [{'topology__seed': seed} for seed in range(3)])
+    ds = vmlab.run(setup, arch_dev_model, progress=False, profile=True, batch=batch, nb_proc=2)
+    for name, (dims, shape) in expected.items():
+        assert (ds[name].dims, ds[name].shape) == (('seed',) + dims, (3,) + shape)
@@ -0,0 +1,71 @@
+import numpy as np
+
+from vmlab.processes._base.ragged import Ragged
+
+
+def random_segments(rng, nb_segments, max_length=4):
+    return [rng.random(length).astype(np.float32) for length in rng.integers(0, max_length + 1, nb_segments)]
+
+
+def assert_segments_equal(ragged, segments):
+    assert len(ragged) == len(segments)
+    for i, segment in enumerate(segments):
+        np.testing.assert_array_equal(ragged[i], segment)
+
+
+def test_from_segments_round_trip():
+    rng = np.random.default_rng(0)
+    segments = random_segments(rng, 50)
+    ragged = Ragged.from_segments(segments)
+    assert_segments_equal(ragged, segments)
+    np.testing.assert_array_equal(ragged.lengths, [len(segment) for segment in segments])
+    np.testing.assert_allclose(ragged.sum(), [np.sum(segment) for segment in segments], rtol=1e-6)
+    assert_segments_equal(Ragged(ragged.lengths, ragged.values), segments)
+    assert_segments_equal(Ragged.from_segments([None, [], [1.]]), [[], [], [1.]])
+
+
+def test_gather_scatter_round_trip():
+    rng = np.random.default_rng(1)
+    segments = random_segments(rng, 50)
+    ragged = Ragged.from_segments(segments)
+    key = rng.permutation(50)[:20]
+    values = ragged.gather(key)
+    np.testing.assert_array_equal(values, np.concatenate([segments[i] for i in key]))
+    np.testing.assert_array_equal(ragged.segment_ids(key), np.repeat(key, [len(segments[i]) for i in key]))
+    ragged.scatter(key, values + 1)
+    for i in key:
+        segments[i] = segments[i] + 1
+    assert_segments_equal(ragged, segments)
+    assert_segments_equal(ragged[key], [segments[i] for i in key])
+
+
+def test_setitem_round_trip():
+    rng = np.random.default_rng(2)
+    segments = random_segments(rng, 50)
+    ragged = Ragged.from_segments(segments)
+    for _ in range(10):
+        key = rng.permutation(50)[:rng.integers(1, 10)]
+        new = random_segments(rng, key.shape[0])
+        ragged[key] = new
+        for i, segment in zip(key, new):
+            segments[i] = segment
+        assert_segments_equal(ragged, segments)
+    # segments of the same lengths are written in place
+    values = ragged.values
+    ragged[[0]] = [segments[0] * 2]
+    assert ragged.values is values
+    np.testing.assert_array_equal(ragged[0], segments[0] * 2)
+
+
+def test_resize_and_conform():
+    rng = np.random.default_rng(3)
+    segments = random_segments(rng, 20)
+    ragged = Ragged.from_segments(segments)
+    grown = ragged.resize(30)
+    assert_segments_equal(grown, segments + [[]] * 10)
+    assert_segments_equal(grown.resize(20), segments)
+    other = Ragged.from_segments(segments[:10] + [np.zeros(len(segment) + 1) for segment in segments[10:]])
+    conformed = ragged.conform(other)
+    np.testing.assert_array_equal(conformed.offsets, other.offsets)
+    assert_segments_equal(conformed, segments[:10] + [np.zeros(len(segment) + 1) for segment in segments[10:]])
+    assert ragged.conform(ragged.copy()) is ragged
@@ -0,0 +1,28 @@
+import numpy as np
+
+import vmlab
+from vmlab.models import arch_dev_model
+
+
+def test_reduced_outputs_equal_reductions_of_recorded_outputs(create_setup):
+    reduced = vmlab.run(create_setup({
+        'topology__appeared': ('day', 'cumsum'),
+        'topology__nb_descendants': ('day', 'sum', 'topology__cycle')
+    }), arch_dev_model, progress=False)
+    recorded = vmlab.run(create_setup({
+        'topology__appeared': 'day',
+        'topology__nb_descendants': 'day',
+        'topology__cycle': 'day'
+    }), arch_dev_model, progress=False)
+
+    appeared = recorded['topology__appeared'].transpose('day', 'GU').values
+    np.testing.assert_array_equal(reduced['topology__appeared'].values, np.nancumsum(np.nansum(appeared, axis=1)))
+
+    nb_descendants = recorded['topology__nb_descendants'].transpose('day', 'GU').values
+    cycle = recorded['topology__cycle'].transpose('day', 'GU').values
+    assert set(reduced['cycle'].values) == set(np.unique(cycle[~np.isnan(cycle)]))
+    expected = np.array([
+        [np.nansum(nb_descendants[day][cycle[day] == group]) for group in reduced['cycle'].values]
+        for day in range(cycle.shape[0])
+    ])
+    np.testing.assert_array_equal(reduced['topology__nb_descendants'].transpose('day', 'cycle').values, expected)
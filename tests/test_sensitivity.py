@@ -0,0 +1,63 @@
+import numpy as np
+import xarray as xr
+
+import vmlab
+from vmlab import sensitivity
+
+# additive linear model y = sum(a * x) of parameters uniform in [low, high]
+parameters = {'p__a': (0., 1.), 'p__b': (-2., 2.), 'p__c': (10., 11.)}
+a = {'p__a': 3., 'p__b': -1., 'p__c': 0.}
+
+
+def linear(input_vars):
+    return {'y': sum(a[name] * value for name, value in input_vars.items())}
+
+
+def run_design(design, nb_groups, failed=()):
+    """Update design with the linear model, the groups in failed are discarded"""
+    for group, runs in enumerate(design.sample(nb_groups), start=design.nb_sampled):
+        if group in failed:
+            design.discard(group)
+        else:
+            design.update(group, [linear(input_vars) for input_vars in runs])
+    return design.indices()
+
+
+def test_morris_recovers_linear_effects():
+    indices = run_design(sensitivity.Morris(parameters, seed=0), 20)
+    width = np.array([high - low for low, high in parameters.values()])
+    effects = np.array(list(a.values())) * width
+    np.testing.assert_allclose(indices['mu'].sel(output='y').values, effects, atol=1e-9)
+    np.testing.assert_allclose(indices['mu_star'].sel(output='y').values, np.abs(effects), atol=1e-9)
+    np.testing.assert_allclose(indices['sigma'].sel(output='y').values, 0., atol=1e-6)
+
+
+def test_sobol_recovers_linear_variance_shares():
+    indices = run_design(sensitivity.Sobol(parameters, seed=0), 1024)
+    width = np.array([high - low for low, high in parameters.values()])
+    variance = (np.array(list(a.values())) * width) ** 2 / 12
+    share = variance / variance.sum()
+    # additive model: first order and total indices are equal
+    np.testing.assert_allclose(indices['S1'].sel(output='y').values, share, atol=0.05)
+    np.testing.assert_allclose(indices['ST'].sel(output='y').values, share, atol=0.05)
+
+
+def test_analyze_skips_groups_with_failed_runs(monkeypatch):
+    failed_runs = {4, 13}
+
+    def run_iter(dataset, model, batch, reduce=None, **kwargs):
+        # runs 4 and 13 failed, errors='skip' does not yield them
+        for id, input_vars in enumerate(batch[1]):
+            if id not in failed_runs:
+                yield id, linear(input_vars)
+
+    monkeypatch.setattr(sensitivity, 'run_iter', run_iter)
+    for design, reference in (
+        (sensitivity.Morris(parameters, seed=1), sensitivity.Morris(parameters, seed=1)),
+        (sensitivity.Sobol(parameters, seed=1), sensitivity.Sobol(parameters, seed=1))
+    ):
+        indices = sensitivity.analyze(None, None, design, {'y': 'sum'}, 8, progress=False, executor=vmlab.Executor(1), errors='skip')
+        failed_groups = set(id // design.group_size for id in failed_runs)
+        expected = run_design(reference, 8, failed=failed_groups)
+        assert indices.attrs['nb_groups'] == 8 - len(failed_groups)
+        xr.testing.assert_identical(indices, expected)
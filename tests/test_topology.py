@@ -0,0 +1,135 @@
+import numpy as np
+import xsimlab as xs
+
+import vmlab
+from vmlab.models import arch_dev_model
+from vmlab.processes.topology import Topology, TreeIndex, get_depth
+
+
+def brute_force_lca(parent, u, v):
+    """LCA by walking up the ancestors, -1 if u and v belong to different trees"""
+    ancestors = set()
+    while u >= 0:
+        ancestors.add(u)
+        u = parent[u]
+    while v >= 0 and v not in ancestors:
+        v = parent[v]
+    return v
+
+
+@xs.process
+class CheckTreeIndex:
+    """Fails the simulation if tree_index or depth miss any GU"""
+
+    parent = xs.foreign(Topology, 'parent')
+    depth = xs.foreign(Topology, 'depth')
+    tree_index = xs.foreign(Topology, 'tree_index')
+
+    def finalize_step(self):
+        assert len(self.tree_index) == self.parent.shape[0]
+        np.testing.assert_array_equal(self.depth, get_depth(self.parent))
+
+
+def test_tree_index_covers_new_gus(create_setup):
+    model = arch_dev_model.update_processes({'check_tree_index': CheckTreeIndex})
+    setup = create_setup({'topology__nb_gu': None}, end_date='2004-06-01', input_vars={'topology__engine': 'numpy'}, model=model)
+    ds = vmlab.run(setup, model)
+    nb_gu_initial = setup['topology__parent'].shape[0]
+    assert ds['topology__nb_gu'].values > nb_gu_initial
+
+
+def test_tree_index_extend_with_orphans():
+    # GUs 4 and 6 did not get a parent and are roots of their own
+    parent = np.array([-1, 0, 0, 1, -1, 3, -1, 5])
+    tree_index = TreeIndex(parent[:4], rebuild_ratio=10.)
+    tree_index.extend(parent[4:])
+    np.testing.assert_array_equal(tree_index.depth, get_depth(parent))
+    u, v = np.meshgrid(np.arange(parent.shape[0]), np.arange(parent.shape[0]))
+    u, v = u.ravel(), v.ravel()
+    expected = np.array([brute_force_lca(parent, a, b) for a, b in zip(u, v)])
+    np.testing.assert_array_equal(tree_index.lca(u, v), expected)
+    distance = tree_index.distance(u, v)
+    assert np.all(np.isinf(distance[expected < 0]))
+    assert np.all(np.isfinite(distance[expected >= 0]))
+
+
+def random_forest(rng, nb_gu, first=0, p_root=0.05):
+    """Parents of GUs first to nb_gu, each attached to any previous GU or a root"""
+    parent = np.array([rng.integers(-1, i) if i > 0 else -1 for i in range(first, nb_gu)])
+    parent[rng.random(parent.shape[0]) < p_root] = -1
+    return parent
+
+
+def assert_tree_index(tree_index, parent, rng, nb_queries=2000):
+    np.testing.assert_array_equal(tree_index.depth, get_depth(parent))
+    u = rng.integers(0, parent.shape[0], nb_queries)
+    v = rng.integers(0, parent.shape[0], nb_queries)
+    expected = np.array([brute_force_lca(parent, a, b) for a, b in zip(u, v)])
+    np.testing.assert_array_equal(tree_index.lca(u, v), expected)
+    depth = get_depth(parent)
+    found = expected >= 0
+    expected_distance = np.full(nb_queries, np.inf)
+    expected_distance[found] = depth[u[found]] + depth[v[found]] - 2 * depth[expected[found]]
+    np.testing.assert_array_equal(tree_index.distance(u, v), expected_distance)
+    np.testing.assert_array_equal(tree_index.distance(u, u), np.zeros(nb_queries))
+
+
+def test_tree_index_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for p_root in (0., 0.05):
+        # the first GU is a root, others too if p_root > 0
+        parent = random_forest(rng, 500, p_root=p_root)
+        assert_tree_index(TreeIndex(parent), parent, rng)
+
+
+def test_tree_index_extend_matches_brute_force():
+    rng = np.random.default_rng(1)
+    # pending GUs only (no rebuild) and rebuilds at most extends
+    for rebuild_ratio in (100., 0.1):
+        parent = random_forest(rng, 100)
+        tree_index = TreeIndex(parent, rebuild_ratio=rebuild_ratio)
+        for _ in range(10):
+            parent = np.append(parent, random_forest(rng, parent.shape[0] + 30, first=parent.shape[0]))
+            tree_index.extend(parent[len(tree_index):])
+            assert len(tree_index) == parent.shape[0]
+            assert_tree_index(tree_index, parent, rng, nb_queries=500)
+
+
+def test_spliced_lstring_equals_derived_lstring(create_setup):
+    setup = create_setup({'topology__nb_gu': None}, end_date='2004-06-01', input_vars={'topology__seed': 5, 'topology__engine': 'lpy'})
+    lstrings = []
+
+    @xs.runtime_hook('finalize', 'model', 'pre')
+    def derive(model, context, state):
+        topology = model['topology']
+        # the L-system derives all GUs of the current tree from the axiom
+        derived = topology.lsystem.derive(topology.lsystem.axiom, 0, int(np.max(topology.depth)))
+        lstrings.append((topology.lstring, derived))
+
+    ds = vmlab.run(setup, arch_dev_model, hooks=[derive], progress=False)
+    assert ds['topology__nb_gu'].values > setup['topology__parent'].shape[0]
+    spliced, derived = lstrings[0]
+    # the phyllotaxy of the initial tree and of bursts differ for 6 lateral children, angles are not compared
+    assert [module.name for module in spliced] == [module.name for module in derived]
+    assert [
+        module[0] for module in spliced if module.name in ('GU', 'A')
+    ] == [
+        module[0] for module in derived if module.name in ('GU', 'A')
+    ]
+
+
+def test_rerun_model_starts_with_new_buffers(create_setup):
+    setup = create_setup({'topology__nb_gu': None}, end_date='2004-06-01', input_vars={'topology__seed': 1})
+    buffers = []
+
+    @xs.runtime_hook('initialize', 'model', 'post')
+    def record_buffers(model, context, state):
+        buffers.append(dict(model.state.buffers))
+
+    model = arch_dev_model.clone()
+    setup.xsimlab.run(model, hooks=[record_buffers], safe_mode=False)
+    old = dict(model.state.buffers)
+    assert old
+    setup.xsimlab.run(model, hooks=[record_buffers], safe_mode=False)
+    # buffers of the first run are not reused nor kept alive by the second run
+    assert all(buffers[1].get(key) is not buffer for key, buffer in old.items())
@@ -1,16 +1,27 @@
-from xsimlab.model import _ModelBuilder, filter_variables
+from xsimlab.model import Model, _ModelBuilder, filter_variables
+from xsimlab.process import SimulationStage
 from xsimlab.variable import VarType
 import numpy as np
 
 from .vmlab import (
     create_setup,
     run,
+    run_iter,
+    fork,
     get_vars_from_model,
     to_graph,
     to_dataframe,
-    check_graph
+    check_graph,
+    check_tree,
+    Executor,
+    BatchError
 )
-from . import constants, enums
+from .monitoring import Profiler, MemoryMonitor
+from .checkpoint import Checkpointer
+from .branching import Brancher
+from .cache import ResultCache
+from .delta import decode_deltas
+from . import constants, enums, sensitivity
 from .vmlab import DotDict
 from ._version import __version__, version_info  # noqa: F401
 
@@ -29,41 +40,124 @@ def fill_value_from_dtype(dtype=None):
         return 0.
 
 
+def get_resize_registry(variables, indices):
+    """Compile, per index, the variables that need a resize if the index changes
+
+    Parameters
+    ----------
+    variables : dict
+        Variables (non index) of the model with state keys as keys
+    indices : dict
+        Index variables of the model with state keys as keys
+
+    Returns
+    -------
+    dict
+        Index name -> list of (state key, {ndim: axes}, fill value) where axes
+        are the positions of the index in the dimensions of ndim and fill value
+        is None if it has to be derived from the dtype of the value
+    """
+    registry = {index_name: [] for _, index_name in indices}
+    for var_name, var in variables.items():
+        if var.metadata.get('var_type') == VarType.FOREIGN:
+            # foreign variables are stored under the key of the variable they refer to
+            continue
+        var_dims = var.metadata.get('dims') or []
+        var_enc = var.metadata.get('encoding') or {}
+        for index_name, entries in registry.items():
+            axes = {}
+            for dims in var_dims:
+                if index_name in dims:
+                    axes[len(dims)] = [axis for axis, dim in enumerate(dims) if dim == index_name]
+            if axes:
+                entries.append((var_name, axes, var_enc.get('fill_value')))
+    return registry
+
+
 class State(dict):
 
     indices = {}
     variables = {}
+    registry = {}
+    buffers = {}
 
-    def __init__(self, variables, indices):
+    # minimum number of items reserved along a growing dimension
+    min_capacity = 16
+
+    def __init__(self, variables, indices, registry=None):
         self.variables = variables
         self.indices = indices
+        self.registry = get_resize_registry(variables, indices) if registry is None else registry
+        self.buffers = {}
         dict.__init__(self)
 
+    def grow(self, var_name, var_value, axes, new_length, fill_value, shared):
+        """Return a view of var_value extended to new_length along axes.
+
+        The view is backed by a buffer that reserves spare capacity along axes.
+        If the buffer is too small a new one with twice the capacity is allocated
+        so that growing a variable GU by GU costs amortized O(1) per GU.
+
+        Parameters
+        ----------
+        var_name : tuple
+            State key of the variable
+        var_value : numpy.ndarray
+            Current value of the variable
+        axes : list of int
+            Axes of the growing dimension
+        new_length : int
+            New length along axes
+        fill_value : scalar
+            Value of the new items
+        shared : set
+            Ids of buffers already used by other variables in the current resize
+
+        Returns
+        -------
+        numpy.ndarray
+            A view of the buffer of length new_length along axes
+        """
+        buffer = self.buffers.get(var_name)
+        if buffer is None or var_value.base is not buffer or id(buffer) in shared:
+            # value was replaced by the process (or is an alias of another variable)
+            buffer = var_value
+        old_slices = tuple(slice(0, i) for i in var_value.shape)
+        if any(buffer.shape[axis] < new_length for axis in axes):
+            shape = list(buffer.shape)
+            for axis in axes:
+                shape[axis] = max(new_length, 2 * buffer.shape[axis], self.min_capacity)
+            buffer = np.empty(shape, dtype=var_value.dtype)
+            buffer[old_slices] = var_value
+        new_slices = tuple(
+            slice(0, new_length) if axis in axes else slice(0, length) for axis, length in enumerate(var_value.shape)
+        )
+        data = buffer[new_slices]
+        # fill all items that are beyond the old length along at least one axis
+        for axis in axes:
+            tail = list(new_slices)
+            tail[axis] = slice(var_value.shape[axis], new_length)
+            buffer[tuple(tail)] = fill_value
+        self.buffers[var_name] = buffer
+        shared.add(id(buffer))
+        return data
+
     def resize(self, index_name, new_shape):
         '''Resize a variable value if a 1D index  in the variables dimensions increased in length.
         '''
-        for var_name, var in self.variables.items():
-            if var_name in self and type(self[var_name]) is np.ndarray:
-                var_value = self[var_name]
-                var_shape = var_value.shape
-                var_dims = np.array(var.metadata.get('dims')).flatten()
-                if len(var_dims) and index_name in var_dims:
-                    fill_value = None
-                    var_enc = var.metadata.get('encoding')
-                    if 'fill_value' in var_enc:
-                        fill_value = var_enc['fill_value']
-                    else:
-                        fill_value = fill_value_from_dtype(var_value.dtype)
-                    var_shape = (var_dims == index_name) * new_shape + (var_dims != index_name) * var_shape
-                    if (tuple(var_shape) != var_value.shape):
-                        if len(var_shape) == 1:
-                            data = np.empty(var_shape, dtype=var_value.dtype)
-                            data[0:var_value.shape[0]] = var_value
-                            data[var_value.shape[0]:] = fill_value
-                        else:
-                            data = np.full(var_shape, fill_value, dtype=var_value.dtype)
-                            data[tuple([slice(0, i) for i in var_value.shape])] = var_value
-                        super(State, self).__setitem__(var_name, data)
+        shared = set()
+        new_length = new_shape[0]
+        for var_name, var_axes, fill_value in self.registry.get(index_name, []):
+            var_value = self.get(var_name)
+            if type(var_value) is not np.ndarray or var_value.ndim not in var_axes:
+                continue
+            axes = var_axes[var_value.ndim]
+            if all(var_value.shape[axis] == new_length for axis in axes):
+                continue
+            if fill_value is None:
+                fill_value = fill_value_from_dtype(var_value.dtype)
+            data = self.grow(var_name, var_value, axes, new_length, fill_value, shared)
+            super(State, self).__setitem__(var_name, data)
 
     def __setitem__(self, item, new):
         if item in self and item in self.indices and self[item].shape != new.shape:
@@ -83,7 +177,7 @@ def set_state(self):
                 non_indices[(p_name, v_name)] = variable
             variables[(p_name, v_name)] = variable
 
-    state = State(non_indices, indices)
+    state = State(non_indices, indices, get_resize_registry(non_indices, indices))
 
     # bind state to each process in the model
     for p_obj in self._processes_obj.values():
@@ -92,19 +186,42 @@ def set_state(self):
     return state
 
 
+_execute = Model.execute
+
+
+def execute(self, stage, runtime_context, **kwargs):
+    if SimulationStage(stage) == SimulationStage.INITIALIZE and isinstance(self._state, State):
+        # a model that is run again (e.g. safe_mode=False) starts with new buffers
+        self._state.buffers = {}
+    return _execute(self, stage, runtime_context, **kwargs)
+
+
 # 'patch' xsimlab to use a custom state class instead of a dict
 _ModelBuilder.set_state = set_state
+Model.execute = execute
 
 
 __all__ = [
     'version_info',
     'create_setup',
     'run',
+    'run_iter',
+    'fork',
     'constants',
     'enums',
+    'sensitivity',
     'DotDict',
     'get_vars_from_model',
     'to_graph',
     'to_dataframe',
-    'check_graph'
+    'check_graph',
+    'check_tree',
+    'Profiler',
+    'MemoryMonitor',
+    'Executor',
+    'BatchError',
+    'Checkpointer',
+    'Brancher',
+    'ResultCache',
+    'decode_deltas'
 ]
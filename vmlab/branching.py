@@ -0,0 +1,227 @@
+import os
+import re
+import sys
+import shutil
+import time
+import pickle
+import tempfile
+import traceback
+import logging
+import inspect
+import xsimlab as xs
+from xsimlab.xr_accessor import _flatten_inputs
+from tqdm.auto import tqdm
+
+
+def _reads(cls, attr_name, stage):
+    """True if the method of stage of cls or of one of its bases reads self.<attr_name>
+
+    Methods of cls called as self.<method>(...) from these methods are scanned as well.
+    """
+    pattern = re.compile(rf'self\.{attr_name}\b')
+    methods = [vars(base)[stage] for base in cls.__mro__ if stage in vars(base)]
+    visited = set()
+    while methods:
+        method = methods.pop()
+        if method in visited:
+            continue
+        visited.add(method)
+        try:
+            source = inspect.getsource(method)
+        except (OSError, TypeError):
+            # source not available, assume it is read
+            return True
+        if pattern.search(source):
+            return True
+        for name in re.findall(r'self\.(\w+)\(', source):
+            helper = getattr(cls, name, None)
+            if inspect.isfunction(helper):
+                methods.append(helper)
+    return False
+
+
+def _stages_reading(model, key):
+    """Stages ('initialize', 'run_step', 'finalize_step') in which any process of the model reads the variable key"""
+    stages = set()
+    for p_obj in model.values():
+        for attr_name, state_key in p_obj.__xsimlab_state_keys__.items():
+            # foreign and global variables refer to the key, groups to a list of keys
+            if state_key != key and not (isinstance(state_key, list) and key in state_key):
+                continue
+            for stage in ('initialize', 'run_step', 'finalize_step'):
+                if _reads(type(p_obj), attr_name, stage):
+                    stages.add(stage)
+    return stages
+
+
+class Brancher(xs.RuntimeHook):
+    """Runtime hook that forks a running simulation into branches at a step
+
+    At the beginning of the step (after the time dependent inputs were updated) the process
+    forks one child per branch, at most nb_proc at a time. The children share the memory of
+    the parent copy-on-write, set the input variables of their branch and run the rest of the
+    simulation. Each child writes its output to a temporary file and exits. The parent stops
+    its simulation once all branches completed.
+
+    Inputs of a branch are set in the state of the model once at the step of the fork, time
+    dependent inputs of the dataset are set again at each following step. Inputs that are
+    read in 'initialize' are rejected by check: values that processes derived from them in
+    'initialize' would keep those of the shared prefix.
+
+    Parameters
+    ----------
+    step : int
+        Step at which the simulation is forked
+    branches : list of dict
+        Input variables of each branch
+    nb_proc : int
+        Maximum number of branches run in parallel
+    progress : bool, optional
+        If true displays progress bars of the prefix and of the branches
+    time_dependent : list of str, optional
+        Names ('process__variable') of the time dependent inputs of the dataset
+    """
+
+    poll_interval = 0.05
+
+    def __init__(self, step, branches, nb_proc, progress=True, time_dependent=()):
+        super().__init__()
+        assert hasattr(os, 'fork'), 'forking requires a platform with os.fork'
+        assert nb_proc > 0
+        self.step = step
+        self.branches = [_flatten_inputs(input_vars) for input_vars in branches]
+        self.nb_proc = nb_proc
+        self.progress = progress
+        self.time_dependent = set(time_dependent)
+        self.index = None
+        self.path = None
+        self.outputs = {}
+        self.failures = {}
+        self._pbar = None
+
+    @property
+    def is_child(self):
+        return self.index is not None
+
+    def check(self, model, force=False):
+        """Test if the inputs of the branches can change the simulation after the fork
+
+        Raises an AssertionError for inputs that no process reads during the steps and,
+        unless force is true, for inputs that are also read in 'initialize', i.e. values
+        derived from them would keep those of the shared prefix.
+        Reads are found in the source of the stage methods of the processes and of the
+        methods they call on self, force also accepts inputs that are read otherwise.
+        """
+        if force:
+            return
+        for key in set(key for input_vars in self.branches for key in input_vars):
+            name = f'{key[0]}__{key[1]}'
+            stages = _stages_reading(model, key)
+            assert stages - {'initialize'}, f'{name} is only read in initialize and can not be branched (see force)'
+            assert 'initialize' not in stages, (
+                f'{name} is read in initialize, values derived from it would keep those of the prefix (see force)'
+            )
+
+    def _fork(self, model, directory):
+        running = {}
+        pbar = tqdm(total=len(self.branches), desc='branches') if self.progress else None
+        for index, input_vars in enumerate(self.branches):
+            while len(running) >= self.nb_proc:
+                self._wait(running, pbar)
+            path = os.path.join(directory, f'{index}.pkl')
+            # avoid duplicate output of buffered text
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                self.index = index
+                self.path = path
+                model.update_state(input_vars, validate=True, ignore_static=True, ignore_invalid_keys=False)
+                return
+            running[pid] = (index, path)
+        while running:
+            self._wait(running, pbar)
+        if pbar is not None:
+            pbar.close()
+
+    def _wait(self, running, pbar):
+        while True:
+            for pid, (index, path) in list(running.items()):
+                done, status = os.waitpid(pid, os.WNOHANG)
+                if done == 0:
+                    continue
+                del running[pid]
+                self._collect(index, path, status)
+                if pbar is not None:
+                    pbar.update(1)
+                return
+            time.sleep(self.poll_interval)
+
+    def _collect(self, index, path, status):
+        try:
+            with open(path, 'rb') as f:
+                is_ok, value = pickle.load(f)
+            os.remove(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            is_ok, value = False, ChildProcessError(f'branch {index} exited with status {status}')
+        if is_ok:
+            self.outputs[index] = value
+        else:
+            self.failures[index] = value
+
+    def send(self, output=None, error=None):
+        """Write the output or the error of a branch to the parent and exit the child
+
+        Parameters
+        ----------
+        output : :class:`xarray.Dataset` object, optional
+            The output of the branch
+        error : Exception, optional
+            The exception raised by the branch
+        """
+        assert self.is_child
+        status = 0
+        try:
+            if error is None:
+                data = pickle.dumps((True, output.load()), protocol=5)
+            else:
+                logging.error(''.join(traceback.format_exception(type(error), error, error.__traceback__)))
+                try:
+                    data = pickle.dumps((False, error), protocol=5)
+                except Exception:
+                    data = pickle.dumps((False, RuntimeError(f'{type(error).__name__}: {error}')), protocol=5)
+                status = 1
+            with open(self.path, 'wb') as f:
+                f.write(data)
+        except BaseException:
+            status = 2
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            # skip the cleanup of the parent, e.g. atexit handlers and the unwinding of its stack
+            os._exit(status)
+
+    @xs.runtime_hook('run_step', 'model', 'pre')
+    def _start_step(self, model, context, state):
+        step = context['step']
+        if self.is_child:
+            # the dataset replaced the time dependent inputs, other inputs keep their updates since the fork
+            input_vars = {
+                key: value for key, value in self.branches[self.index].items() if f'{key[0]}__{key[1]}' in self.time_dependent
+            }
+            model.update_state(input_vars, validate=False, ignore_static=True)
+        elif step < self.step:
+            if self.progress:
+                if self._pbar is None:
+                    self._pbar = tqdm(total=self.step, desc='prefix')
+                self._pbar.update(1)
+        else:
+            if self._pbar is not None:
+                self._pbar.close()
+                self._pbar = None
+            directory = tempfile.mkdtemp()
+            self._fork(model, directory)
+            if self.is_child:
+                return None
+            shutil.rmtree(directory, ignore_errors=True)
+            return xs.RuntimeSignal.BREAK
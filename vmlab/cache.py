@@ -0,0 +1,231 @@
+import os
+import glob
+import shutil
+import pickle
+import hashlib
+import inspect
+import pathlib
+import numpy as np
+import toml
+import xarray as xr
+from xsimlab.xr_accessor import _flatten_inputs
+
+
+def _update_file(h, path, visited):
+    """Hash the content of a file or of all files of a directory and the files referenced by toml files"""
+    path = pathlib.Path(path).resolve()
+    if path in visited:
+        return
+    visited.add(path)
+    if path.is_dir():
+        for child in sorted(path.rglob('*')):
+            if child.is_file():
+                _update_file(h, child, visited)
+        return
+    if not path.is_file():
+        h.update(f'missing {path}'.encode())
+        return
+    content = path.read_bytes()
+    h.update(str(path).encode())
+    h.update(hashlib.sha256(content).digest())
+    if path.suffix == '.toml':
+        # e.g. probability tables, weather data and lpy parameters are referenced relative to the toml file
+        try:
+            values = toml.loads(content.decode())
+        except (UnicodeDecodeError, toml.TomlDecodeError):
+            return
+        for value in _strings(values):
+            if not value.strip():
+                continue
+            reference = path.parent.joinpath(value).resolve()
+            # e.g. '.' or '..' are not references, they would hash the whole directory of the toml file
+            if reference in path.parents:
+                continue
+            if reference.exists():
+                _update_file(h, reference, visited)
+
+
+def _strings(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _strings(item)
+
+
+def _update_value(h, name, value, visited):
+    """Hash a named value, parameter files (variables named '*file_path') are hashed by content"""
+    value = np.asarray(value)
+    h.update(f'{name} {value.dtype.str} {value.shape}'.encode())
+    if value.dtype.kind == 'O':
+        h.update(pickle.dumps(value.tolist(), protocol=4))
+    else:
+        h.update(np.ascontiguousarray(value).tobytes())
+    if name.endswith('file_path') and value.ndim == 0 and value.dtype.kind in 'UO' and value.item():
+        _update_file(h, str(value.item()), visited)
+
+
+def _package_digest():
+    """Hash of the version and of all modules and L-systems of the vmlab package"""
+    from ._version import __version__
+    root = pathlib.Path(__file__).parent
+    h = hashlib.sha256(__version__.encode())
+    for path in sorted(root.rglob('*')):
+        if path.suffix in ('.py', '.lpy') and path.is_file():
+            h.update(str(path.relative_to(root)).encode())
+            h.update(hashlib.sha256(path.read_bytes()).digest())
+    return h.digest()
+
+
+def _update_model(h, model, sources):
+    """Hash the vmlab package, the process names, classes and the source files they are defined in"""
+    # helpers of the processes (e.g. ragged arrays, the State class) change results as well
+    if 'vmlab' not in sources:
+        sources['vmlab'] = _package_digest()
+    h.update(sources['vmlab'])
+    for p_name in model:
+        h.update(p_name.encode())
+        for cls in type(model[p_name]).__mro__:
+            if cls is object:
+                continue
+            h.update(f'{cls.__module__}.{cls.__qualname__}'.encode())
+            try:
+                path = inspect.getsourcefile(cls)
+            except TypeError:
+                # e.g. classes created by xsimlab
+                continue
+            if path is None:
+                continue
+            if path not in sources:
+                source = hashlib.sha256(pathlib.Path(path).read_bytes())
+                # L-systems of processes are files next to their module
+                lpy = pathlib.Path(path).with_suffix('.lpy')
+                if lpy.is_file():
+                    source.update(lpy.read_bytes())
+                sources[path] = source.digest()
+            h.update(sources[path])
+
+
+class ResultCache():
+    """On-disk cache of the outputs of vmlab runs, addressed by the content of the run
+
+    The key of a run is a hash of the version and sources of the vmlab package, of the
+    processes of the model (names, classes and the source of their modules and L-systems),
+    of all variables and attributes of the setup dataset (clock, initial tree, inputs like
+    the seed, outputs), of the contents of the parameter
+    files referenced by '*file_path' inputs (and the files they reference) and of the
+    input_vars of the run. Outputs are stored as zarr stores, the least recently used
+    are removed once the cache exceeds max_size.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the cache
+    max_size : int, optional
+        Maximum size [B] of the cache. Unlimited if None
+    """
+
+    def __init__(self, path, max_size=None):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok=True)
+        # hashes of source files
+        self._sources = {}
+
+    def key(self, dataset, model, input_vars=None):
+        """Key of a run of model with dataset updated with input_vars
+
+        Returns
+        -------
+        str
+        """
+        h = hashlib.sha256()
+        visited = set()
+        _update_model(h, model, self._sources)
+        h.update(repr(sorted(dataset.attrs.items())).encode())
+        for name in sorted(dataset.variables):
+            variable = dataset.variables[name]
+            h.update(repr((variable.dims, sorted(variable.attrs.items()))).encode())
+            _update_value(h, str(name), variable.values, visited)
+        if input_vars:
+            inputs = _flatten_inputs(input_vars)
+            for p_name, v_name in sorted(inputs):
+                _update_value(h, f'{p_name}__{v_name}', inputs[(p_name, v_name)], visited)
+        return h.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.path, f'{key}.zarr')
+
+    def get(self, key):
+        """The output stored under key or None
+
+        Returns
+        -------
+        output : :class:`xarray.Dataset` object or None
+        """
+        entry = self._entry(key)
+        if not os.path.isdir(entry):
+            return None
+        try:
+            # same decoding as vmlab.run
+            ds = xr.open_zarr(entry, consolidated=True, mask_and_scale=False).load()
+        except (OSError, KeyError, ValueError):
+            return None
+        os.utime(entry)
+        for variable in ds.variables.values():
+            variable.encoding = {}
+        return ds
+
+    def put(self, key, ds):
+        """Store an output under key and evict the least recently used outputs if needed
+
+        Returns
+        -------
+        bool
+            False if the output can not be stored (e.g. object variables)
+        """
+        entry = self._entry(key)
+        tmp = f'{entry}.{os.getpid()}.tmp'
+        # no default fill values (e.g. NaN of floats) that a fresh run does not have
+        encoding = {name: {'_FillValue': None} for name, variable in ds.variables.items() if '_FillValue' not in variable.attrs}
+        try:
+            ds.to_zarr(tmp, mode='w', consolidated=True, encoding=encoding)
+            os.replace(tmp, entry)
+        except Exception:
+            # not serializable or stored concurrently
+            shutil.rmtree(tmp, ignore_errors=True)
+            return os.path.isdir(entry)
+        self._evict()
+        return True
+
+    def size(self):
+        """Size [B] of all outputs in the cache"""
+        return sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        entries = []
+        for entry in glob.glob(os.path.join(self.path, '*.zarr')):
+            size = sum(
+                os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(entry) for file in files
+            )
+            entries.append((os.path.getmtime(entry), entry, size))
+        return entries
+
+    def _evict(self):
+        if self.max_size is None:
+            return
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        for _, entry, size in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove all outputs from the cache"""
+        for entry in glob.glob(os.path.join(self.path, '*.zarr')):
+            shutil.rmtree(entry, ignore_errors=True)
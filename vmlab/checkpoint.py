@@ -0,0 +1,197 @@
+import io
+import os
+import glob
+import gzip
+import pickle
+import attr
+import numpy as np
+import xsimlab as xs
+from xsimlab.stores import default_fill_value_from_dtype
+
+
+class _Pickler(pickle.Pickler):
+    """Pickler that refuses processes and models, e.g. referenced by bound methods or L-systems
+    """
+
+    def persistent_id(self, obj):
+        if isinstance(obj, xs.Model) or hasattr(obj, '__xsimlab_state_keys__'):
+            raise pickle.PicklingError('processes and models are not part of a checkpoint')
+        return None
+
+
+def _dumps(value):
+    """Pickled value or None if it can not be pickled"""
+    file = io.BytesIO()
+    try:
+        _Pickler(file, protocol=5).dump(value)
+    except Exception:
+        return None
+    return file.getvalue()
+
+
+def _step(path):
+    return int(os.path.splitext(os.path.basename(path))[0])
+
+
+def has_checkpoint(path):
+    """True if path is a checkpoint file or a directory with checkpoints"""
+    if os.path.isdir(path):
+        return len(glob.glob(os.path.join(path, '*.ckpt'))) > 0
+    return os.path.isfile(path)
+
+
+class Checkpointer(xs.RuntimeHook):
+    """Runtime hook that writes checkpoints of a simulation and restarts a simulation from one
+
+    A checkpoint holds the state of the model and the instance attributes of its processes
+    (e.g. random number generators, probability tables) at the beginning of a step, i.e. after
+    the time dependent inputs were updated. Attributes that can not be pickled (e.g. L-systems)
+    are recreated by 'initialize'. Processes may return additional values with a '_checkpoint'
+    method that are passed to their '_restore' method. Each checkpoint file also holds the
+    outputs recorded since the previous one such that the outputs of a restarted simulation
+    are identical to those of an uninterrupted one.
+
+    A restarted simulation runs 'initialize', skips all steps before the checkpoint and
+    restores the checkpoint at the beginning of its step. The outputs of the skipped steps
+    are restored by merge_outputs.
+
+    Parameters
+    ----------
+    dataset : :class:`xarray.Dataset` object
+        The input dataset of the simulation
+    path : str, optional
+        Directory the checkpoints are written to. No checkpoints are written if None
+    freq : int, optional
+        Number of steps between two checkpoints
+    resume_from : str, optional
+        A checkpoint file or a directory of checkpoints (the latest is used) to restart from
+    """
+
+    def __init__(self, dataset, path=None, freq=30, resume_from=None):
+        super().__init__()
+        assert freq > 0
+        self.path = path
+        self.freq = freq
+        master_clock = dataset.xsimlab.master_clock_dim
+        self.output_vars = []
+        for clock, var_keys in dataset.xsimlab.output_vars_by_clock.items():
+            assert clock is None or clock == master_clock, 'checkpoints support only outputs of the master clock'
+            if clock is not None:
+                self.output_vars.extend(var_keys)
+        self._outputs = {var_key: [] for var_key in self.output_vars}
+        self._last_step = 0
+        self._resume_step = -1
+        self._checkpoint = None
+        self._prefix = {var_key: [] for var_key in self.output_vars}
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+        if resume_from is not None:
+            self._load(resume_from)
+
+    def _load(self, resume_from):
+        if os.path.isdir(resume_from):
+            files = sorted(glob.glob(os.path.join(resume_from, '*.ckpt')), key=_step)
+            assert len(files), f'no checkpoint in {resume_from}'
+        else:
+            files = sorted(
+                [file for file in glob.glob(os.path.join(os.path.dirname(resume_from), '*.ckpt')) if _step(file) <= _step(resume_from)],
+                key=_step
+            )
+        for file in files:
+            with gzip.open(file, 'rb') as f:
+                checkpoint = pickle.load(f)
+            for var_key in self.output_vars:
+                self._prefix[var_key].extend(checkpoint['outputs'][var_key])
+        self._checkpoint = checkpoint
+        self._resume_step = checkpoint['step']
+        self._last_step = checkpoint['step']
+
+    def _write(self, model, step):
+        state = {}
+        for key, value in model.state.items():
+            data = _dumps(value)
+            if data is not None:
+                state[key] = data
+        processes = {}
+        for name, p_obj in model.items():
+            attrs = {}
+            for attr_name, value in vars(p_obj).items():
+                if attr_name.startswith('__xsimlab') or callable(value):
+                    continue
+                data = _dumps(value)
+                if data is not None:
+                    attrs[attr_name] = data
+            extra = p_obj._checkpoint() if hasattr(p_obj, '_checkpoint') else None
+            processes[name] = (attrs, extra)
+        checkpoint = {'step': step, 'state': state, 'processes': processes, 'outputs': self._outputs}
+        file = os.path.join(self.path, f'{step:08d}.ckpt')
+        with gzip.open(file + '.tmp', 'wb', compresslevel=1) as f:
+            pickle.dump(checkpoint, f, protocol=5)
+        os.replace(file + '.tmp', file)
+        self._outputs = {var_key: [] for var_key in self.output_vars}
+        self._last_step = step
+
+    def _restore(self, model):
+        checkpoint = self._checkpoint
+        if hasattr(model.state, 'buffers'):
+            model.state.buffers = {}
+        # bypass resizing of the State
+        dict.update(model.state, {key: pickle.loads(data) for key, data in checkpoint['state'].items()})
+        for name, (attrs, extra) in checkpoint['processes'].items():
+            p_obj = model[name]
+            for attr_name, data in attrs.items():
+                setattr(p_obj, attr_name, pickle.loads(data))
+            if extra is not None:
+                p_obj._restore(extra)
+        self._checkpoint = None
+
+    @xs.runtime_hook('run_step', 'model', 'pre')
+    def _start_step(self, model, context, state):
+        step = context['step']
+        if step < self._resume_step:
+            return xs.RuntimeSignal.SKIP
+        if step == self._resume_step:
+            self._restore(model)
+        elif self.path is not None and step - self._last_step >= self.freq:
+            self._write(model, step)
+
+    @xs.runtime_hook('run_step', 'model', 'post')
+    def _record_step(self, model, context, state):
+        if context['step'] < self._resume_step or self.path is None:
+            return
+        # the values written to the store right after this hook
+        for var_key in self.output_vars:
+            model.update_cache(var_key)
+            self._outputs[var_key].append(np.array(model.cache[var_key]['value'], copy=True))
+
+    @xs.runtime_hook('finalize_step', 'model', 'pre')
+    def _skip_finalize_step(self, model, context, state):
+        if context['step'] < self._resume_step:
+            return xs.RuntimeSignal.SKIP
+
+    def merge_outputs(self, ds, model):
+        """Replace the outputs of the skipped steps of a restarted simulation by those of the checkpoints
+
+        Parameters
+        ----------
+        ds : :class:`xarray.Dataset` object
+            The output dataset of the restarted simulation
+        model : :class:`xsimlab.Model` object
+            The model of the simulation
+
+        Returns
+        -------
+        dataset : :class:`xarray.Dataset` object
+        """
+        for (p_name, v_name), values in self._prefix.items():
+            name = f'{p_name}__{v_name}'
+            if name not in ds or not len(values):
+                continue
+            data = ds[name].values
+            encoding = attr.fields_dict(type(model[p_name]))[v_name].metadata.get('encoding') or {}
+            fill_value = encoding.get('fill_value', default_fill_value_from_dtype(data.dtype))
+            for step, value in enumerate(values):
+                data[step] = fill_value
+                data[(step,) + tuple(slice(0, length) for length in np.shape(value))] = value
+            ds[name] = ds[name].copy(data=data)
+        return ds
@@ -0,0 +1,234 @@
+import attr
+import numpy as np
+import xarray as xr
+import xsimlab as xs
+import dask
+import dask.array as da
+from xsimlab.stores import default_fill_value_from_dtype
+
+
+def parse_delta(name, item, clocks, model):
+    """Check the delta encoding of an output variable
+
+    Parameters
+    ----------
+    name : str
+        Name of the output variable ('foo__bar') with dimensions ('GU',)
+    item : tuple
+        (clock, 'delta') or (clock, 'delta', keyframe_freq) where keyframe_freq is the
+        number of snapshots between two snapshots that are recorded entirely (default 30)
+    clocks : list
+        Clocks of the setup
+    model : :class:`xsimlab.Model` object
+
+    Returns
+    -------
+    str
+        'name,clock,keyframe_freq' to be stored as attribute of a dataset
+    """
+    assert 2 <= len(item) <= 3 and item[1] == 'delta', f'delta encoding of {name} must be (clock, \'delta\'[, keyframe_freq])'
+    clock, _, freq = tuple(item) + (30,) * (3 - len(item))
+    assert clock in clocks, f'delta encoding of {name} requires a clock'
+    assert int(freq) > 0
+    p_name, v_name = name.split('__')
+    dims = xs.filter_variables(model[p_name])[v_name].metadata['dims']
+    assert ('GU',) in dims, f'{name} has no dimensions (GU,)'
+    return f'{name},{clock},{int(freq)}'
+
+
+def _is_changed(new, old):
+    """Elementwise inequality where NaN (NaT) equals NaN (NaT)"""
+    changed = new != old
+    if new.dtype.kind in 'fc':
+        changed &= ~(np.isnan(new) & np.isnan(old))
+    elif new.dtype.kind in 'mM':
+        changed &= ~(np.isnat(new) & np.isnat(old))
+    return changed
+
+
+def _pad(value, length, fill_value):
+    if value.shape[0] >= length:
+        return value
+    padded = np.full(length, fill_value, dtype=value.dtype)
+    padded[:value.shape[0]] = value
+    return padded
+
+
+class DeltaRecorder(xs.RuntimeHook):
+    """Runtime hook that records per GU variables as changes between snapshots
+
+    Snapshots are taken after each 'run_step' and at the end of the simulation like
+    xarray-simlab records outputs of a clock. Every keyframe_freq-th snapshot is recorded
+    entirely (a keyframe), otherwise only the GUs whose value changed (new GUs included)
+    and their values. The dataset of the hook holds the encoded variables, decode_deltas
+    reconstructs the snapshots. Outputs of restarted simulations (checkpoints) are not supported.
+
+    Parameters
+    ----------
+    deltas : list of str
+        'name,clock,keyframe_freq' of each variable (see parse_delta)
+    """
+
+    def __init__(self, deltas):
+        super().__init__()
+        self.deltas = [(name, clock, int(freq)) for name, clock, freq in (delta.split(',') for delta in deltas)]
+        self._clear()
+
+    def _clear(self):
+        self.days = []
+        self.encodings = {}
+        self.previous = {}
+        self.lengths = {}
+        self.keyframes = {name: [] for name, _, _ in self.deltas}
+        self.changes = {name: [] for name, _, _ in self.deltas}
+
+    def _record(self, state, day):
+        record = len(self.days)
+        self.days.append(day)
+        for name, clock, freq in self.deltas:
+            p_name, v_name = name.split('__')
+            value = np.array(state[(p_name, v_name)], copy=True).reshape(-1)
+            fill_value = self.encodings[name].get('fill_value', default_fill_value_from_dtype(value.dtype))
+            self.lengths[name] = max(self.lengths.get(name, 0), value.shape[0])
+            if record % freq == 0:
+                self.keyframes[name].append(value)
+            else:
+                previous = self.previous[name]
+                # GUs beyond the length of a snapshot have the fill value
+                length = max(previous.shape[0], value.shape[0])
+                new = _pad(value, length, fill_value)
+                gus = np.flatnonzero(_is_changed(new, _pad(previous, length, fill_value)))
+                self.changes[name].append((record, gus, new[gus]))
+            self.previous[name] = value
+
+    @xs.runtime_hook('initialize', 'model', 'pre')
+    def _reset(self, model, context, state):
+        self._clear()
+        for name, _, _ in self.deltas:
+            p_name, v_name = name.split('__')
+            self.encodings[name] = attr.fields_dict(type(model[p_name]))[v_name].metadata.get('encoding') or {}
+
+    @xs.runtime_hook('run_step', 'model', 'post')
+    def _record_step(self, model, context, state):
+        self._record(state, context['step_start'])
+
+    @xs.runtime_hook('finalize', 'model', 'pre')
+    def _record_end(self, model, context, state):
+        self._record(state, context['sim_end'])
+
+    def to_dataset(self):
+        """Encoded variables as a Dataset
+
+        For each variable 'name' the dataset has
+            - 'name__keyframes' (name__keyframe, GU): the keyframes padded with the fill value
+            - 'name__is_keyframe' (clock): true for the snapshots that are keyframes
+            - 'name__delta_record', 'name__delta_gu' and 'name__delta_value' (name__delta):
+              position of the snapshot in the clock, GU and new value of each change
+            - 'name__delta_count': the number of changes
+
+        Returns
+        -------
+        dataset : :class:`xarray.Dataset` object
+        """
+
+        days = np.array(self.days, dtype='datetime64[ns]')
+        data_vars = {}
+        coords = {}
+        for name, clock, freq in self.deltas:
+            keyframes = self.keyframes[name]
+            if not keyframes:
+                continue
+            dtype = keyframes[0].dtype
+            fill_value = self.encodings[name].get('fill_value', default_fill_value_from_dtype(dtype))
+            dense = np.full((len(keyframes), self.lengths[name]), fill_value, dtype=dtype)
+            for i, keyframe in enumerate(keyframes):
+                dense[i, :keyframe.shape[0]] = keyframe
+            changes = self.changes[name]
+            records = np.concatenate([np.full(gus.shape[0], record, dtype=np.int32) for record, gus, _ in changes] + [np.empty(0, np.int32)])
+            gus = np.concatenate([gus for _, gus, _ in changes] + [np.empty(0, np.int64)]).astype(np.int32)
+            values = np.concatenate([values for _, _, values in changes] + [np.empty(0, dtype)])
+            data_vars[f'{name}__keyframes'] = ((f'{name}__keyframe', 'GU'), dense)
+            data_vars[f'{name}__is_keyframe'] = ((clock,), np.arange(days.shape[0]) % freq == 0)
+            data_vars[f'{name}__delta_record'] = ((f'{name}__delta',), records)
+            data_vars[f'{name}__delta_gu'] = ((f'{name}__delta',), gus)
+            data_vars[f'{name}__delta_value'] = ((f'{name}__delta',), values)
+            data_vars[f'{name}__delta_count'] = ((), np.int64(records.shape[0]))
+            coords[clock] = days
+
+        return xr.Dataset(data_vars, coords=coords)
+
+
+def _decode_block(keyframe, start, stop, records, gus, values):
+    """Snapshots start to stop (excluded) from the keyframe at start and the changes in between"""
+    keyframe = np.asarray(keyframe)
+    gus = np.asarray(gus)
+    values = np.asarray(values)
+    block = np.empty((stop - start, keyframe.shape[0]), dtype=keyframe.dtype)
+    block[0] = keyframe
+    bounds = np.searchsorted(records, np.arange(start, stop + 1))
+    for record in range(start + 1, stop):
+        i = record - start
+        block[i] = block[i - 1]
+        lo, hi = bounds[i], bounds[i + 1]
+        block[i, gus[lo:hi]] = values[lo:hi]
+    return block
+
+
+def _decode(keyframes, is_keyframe, records, gus, values):
+    """Lazy (dask) array of all snapshots of one run, one chunk per keyframe"""
+    is_keyframe = np.asarray(is_keyframe)
+    records = np.asarray(records)
+    starts = np.flatnonzero(is_keyframe)
+    stops = np.append(starts[1:], is_keyframe.shape[0])
+    blocks = []
+    for k, (start, stop) in enumerate(zip(starts.tolist(), stops.tolist())):
+        lo, hi = np.searchsorted(records, [start, stop])
+        block = dask.delayed(_decode_block, pure=True)(
+            keyframes[k], start, stop, records[lo:hi], gus[lo:hi], values[lo:hi]
+        )
+        blocks.append(da.from_delayed(block, shape=(stop - start, keyframes.shape[-1]), dtype=keyframes.dtype))
+    return da.concatenate(blocks, axis=0)
+
+
+def decode_deltas(ds):
+    """Replace the delta encoded variables of an output by their snapshots
+
+    The snapshots are reconstructed lazily (dask) one keyframe interval at a time
+    once they are accessed. Leading dimensions of the encoded variables
+    (e.g. the batch dimension of a zarr store) are kept.
+
+    Parameters
+    ----------
+    ds : :class:`xarray.Dataset` object
+        An output with variables encoded by DeltaRecorder
+
+    Returns
+    -------
+    dataset : :class:`xarray.Dataset` object
+    """
+
+    names = [name[:-len('__delta_record')] for name in ds.data_vars if name.endswith('__delta_record')]
+    for name in names:
+        keyframes = ds[f'{name}__keyframes']
+        is_keyframe = ds[f'{name}__is_keyframe']
+        counts = np.asarray(ds[f'{name}__delta_count'].values)
+        records = ds[f'{name}__delta_record']
+        leading = counts.shape
+        runs = []
+        for index in np.ndindex(*leading):
+            # the encoded variables of runs of a batch store are padded to the longest run
+            count = int(counts[index])
+            runs.append(_decode(
+                keyframes.data[index], np.asarray(is_keyframe.values[index], dtype=bool),
+                np.asarray(records.values[index][:count]), ds[f'{name}__delta_gu'].data[index][:count],
+                ds[f'{name}__delta_value'].data[index][:count]
+            ))
+        data = da.stack(runs).reshape(leading + runs[0].shape) if leading else runs[0]
+        dims = keyframes.dims[:-2] + (is_keyframe.dims[-1], keyframes.dims[-1])
+        encoded = [
+            f'{name}__keyframes', f'{name}__is_keyframe', f'{name}__delta_record',
+            f'{name}__delta_gu', f'{name}__delta_value', f'{name}__delta_count'
+        ]
+        ds = ds.drop_vars(encoded + ([name] if name in ds else []))
+        ds[name] = (dims, data)
+    return ds
@@ -0,0 +1,248 @@
+import sys
+import time
+import tracemalloc
+import numpy as np
+import xarray as xr
+import xsimlab as xs
+
+
+def _process_stage_hooks(stage):
+    """Hook methods that time each process in a simulation stage
+    """
+
+    @xs.runtime_hook(stage, 'model', 'pre')
+    def start_stage(self, model, context, state):
+        self._stage_times = []
+
+    @xs.runtime_hook(stage, 'process', 'pre')
+    def start_process(self, model, context, state):
+        self._start = time.perf_counter()
+
+    @xs.runtime_hook(stage, 'process', 'post')
+    def stop_process(self, model, context, state):
+        self._stage_times.append(time.perf_counter() - self._start)
+
+    @xs.runtime_hook(stage, 'model', 'post')
+    def stop_stage(self, model, context, state):
+        self.times[stage].append(self._stage_times)
+
+    return start_stage, start_process, stop_process, stop_stage
+
+
+class Profiler(xs.RuntimeHook):
+    """Runtime hook that records the wall-clock time [s] each process spends in each simulation stage
+
+    'run_step' and 'finalize_step' are recorded for each step, 'initialize' and 'finalize' once.
+    The number of GUs is recorded after each 'run_step'.
+    Processes are executed sequentially in the order of the model.
+    """
+
+    stages = ('initialize', 'run_step', 'finalize_step', 'finalize')
+
+    (
+        _start_initialize, _start_process_initialize, _stop_process_initialize, _stop_initialize
+    ) = _process_stage_hooks('initialize')
+    (
+        _start_run_step, _start_process_run_step, _stop_process_run_step, _stop_run_step
+    ) = _process_stage_hooks('run_step')
+    (
+        _start_finalize_step, _start_process_finalize_step, _stop_process_finalize_step, _stop_finalize_step
+    ) = _process_stage_hooks('finalize_step')
+    (
+        _start_finalize, _start_process_finalize, _stop_process_finalize, _stop_finalize
+    ) = _process_stage_hooks('finalize')
+
+    def __init__(self):
+        super().__init__()
+        self._clear()
+
+    def _clear(self):
+        self.processes = []
+        self.days = []
+        self.nb_gu = []
+        self.times = {stage: [] for stage in self.stages}
+        self._stage_times = []
+        self._start = 0.
+
+    @xs.runtime_hook('initialize', 'model', 'pre')
+    def _reset(self, model, context, state):
+        self._clear()
+        self.processes = list(model)
+
+    @xs.runtime_hook('run_step', 'model', 'post')
+    def _record_step(self, model, context, state):
+        self.days.append(context['step_start'])
+        nb_gu = 0
+        for key, value in state.items():
+            if key[1] == 'GU' and isinstance(value, np.ndarray):
+                nb_gu = value.shape[0]
+                break
+        self.nb_gu.append(nb_gu)
+
+    def to_dataset(self):
+        """Profile as a Dataset with dimensions 'process' and 'day'
+
+        Returns
+        -------
+        dataset : :class:`xarray.Dataset` object
+            Variables are named 'profile__<stage>' and 'profile__nb_gu'
+        """
+
+        days = np.array(self.days, dtype='datetime64[ns]')
+        data_vars = {
+            'profile__nb_gu': (('day',), np.array(self.nb_gu, dtype=np.int64), {'description': 'Number of GUs after run_step'})
+        }
+        for stage in self.stages:
+            times = np.array(self.times[stage], dtype=np.float64).reshape(-1, len(self.processes))
+            attrs = {'unit': 's', 'description': f'Wall-clock time of {stage} per process'}
+            if stage in ('run_step', 'finalize_step'):
+                # the last step may have been interrupted
+                nb_steps = min(times.shape[0], days.shape[0])
+                padded = np.full((days.shape[0], len(self.processes)), np.nan)
+                padded[:nb_steps] = times[:nb_steps]
+                data_vars[f'profile__{stage}'] = (('process', 'day'), padded.T, attrs)
+            elif times.shape[0]:
+                data_vars[f'profile__{stage}'] = (('process',), times[-1], attrs)
+
+        return xr.Dataset(data_vars, coords={'process': self.processes, 'day': days})
+
+
+def _peak_rss():
+    """Peak resident set size [bytes] of the current process (NaN if not available)
+    """
+    try:
+        import resource
+    except ImportError:
+        return np.nan
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _nbytes(value, buffer=None):
+    """Number of bytes allocated for the value of a variable
+
+    Values that are views of a State buffer are accounted with the size of the buffer.
+    Object arrays are accounted with their pointers only.
+    """
+    if isinstance(value, np.ndarray):
+        if buffer is not None and value.base is buffer:
+            return buffer.nbytes
+        return value.nbytes
+    # processes import vmlab, hence no module level import
+    from .processes._base.ragged import Ragged
+    if isinstance(value, Ragged):
+        return value.offsets.nbytes + value.values.nbytes
+    return sys.getsizeof(value)
+
+
+class MemoryMonitor(xs.RuntimeHook):
+    """Runtime hook that records the memory footprint of the model state after each step
+
+    The bytes of each variable (including the spare capacity of growing GU variables),
+    their sum per process and the peak resident set size of the process are recorded.
+    If trace is true the allocations during 'run_step' of each process are attributed with
+    tracemalloc: the peak of the memory allocated and the memory retained after 'run_step'.
+    Tracing slows down the simulation considerably.
+
+    Parameters
+    ----------
+    trace : bool, optional
+        If true attribute allocations to the processes with tracemalloc
+    """
+
+    def __init__(self, trace=True):
+        super().__init__()
+        self.trace = trace
+        self._clear()
+
+    def _clear(self):
+        self.processes = []
+        self.days = []
+        self.nbytes = []
+        self.peak_rss = []
+        self.alloc_peak = []
+        self.alloc_retained = []
+        self._step_peak = []
+        self._step_retained = []
+        self._traced = 0
+        self._started_tracing = False
+
+    @xs.runtime_hook('initialize', 'model', 'pre')
+    def _start(self, model, context, state):
+        self._clear()
+        self.processes = list(model)
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    @xs.runtime_hook('finalize', 'model', 'post')
+    def _stop(self, model, context, state):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @xs.runtime_hook('run_step', 'model', 'pre')
+    def _start_step(self, model, context, state):
+        self._step_peak = []
+        self._step_retained = []
+
+    @xs.runtime_hook('run_step', 'process', 'pre')
+    def _start_process(self, model, context, state):
+        if self.trace:
+            tracemalloc.reset_peak()
+            self._traced = tracemalloc.get_traced_memory()[0]
+
+    @xs.runtime_hook('run_step', 'process', 'post')
+    def _stop_process(self, model, context, state):
+        if self.trace:
+            current, peak = tracemalloc.get_traced_memory()
+            self._step_peak.append(peak - self._traced)
+            self._step_retained.append(current - self._traced)
+
+    @xs.runtime_hook('run_step', 'model', 'post')
+    def _record_step(self, model, context, state):
+        self.days.append(context['step_start'])
+        # hooks get a frozen copy of the state, the buffers are only on the state of the model
+        buffers = model.state.buffers
+        self.nbytes.append({
+            f'{key[0]}__{key[1]}': _nbytes(value, buffers.get(key)) for key, value in state.items()
+        })
+        self.peak_rss.append(_peak_rss())
+        if self.trace:
+            self.alloc_peak.append(self._step_peak)
+            self.alloc_retained.append(self._step_retained)
+
+    def to_dataset(self):
+        """Memory footprint as a Dataset with dimensions 'variable', 'process' and 'day'
+
+        Returns
+        -------
+        dataset : :class:`xarray.Dataset` object
+            Variables are named 'memory__<name>', all values are bytes
+        """
+
+        days = np.array(self.days, dtype='datetime64[ns]')
+        variables = sorted(set(name for step in self.nbytes for name in step))
+        nbytes = np.full((len(variables), days.shape[0]), np.nan)
+        for i, step in enumerate(self.nbytes):
+            nbytes[:, i] = [step.get(name, np.nan) for name in variables]
+        processes = np.array([name.split('__')[0] for name in variables])
+        nbytes_process = np.array([np.nansum(nbytes[processes == name], axis=0) for name in self.processes])
+
+        data_vars = {
+            'memory__variable': (('variable', 'day'), nbytes, {'unit': 'B', 'description': 'Allocated memory per variable'}),
+            'memory__process': (('process', 'day'), nbytes_process.reshape(-1, days.shape[0]), {'unit': 'B', 'description': 'Allocated memory of the variables per process'}),
+            'memory__peak_rss': (('day',), np.array(self.peak_rss, dtype=np.float64), {'unit': 'B', 'description': 'Peak resident set size'})
+        }
+        if self.trace:
+            data_vars['memory__run_step_peak'] = (
+                ('process', 'day'), np.array(self.alloc_peak, dtype=np.float64).reshape(-1, len(self.processes)).T,
+                {'unit': 'B', 'description': 'Peak memory allocated during run_step per process'}
+            )
+            data_vars['memory__run_step_retained'] = (
+                ('process', 'day'), np.array(self.alloc_retained, dtype=np.float64).reshape(-1, len(self.processes)).T,
+                {'unit': 'B', 'description': 'Memory retained after run_step per process'}
+            )
+
+        return xr.Dataset(data_vars, coords={'variable': variables, 'process': self.processes, 'day': days})
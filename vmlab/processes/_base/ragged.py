@@ -0,0 +1,135 @@
+import numpy as np
+
+
+class Ragged():
+    """A ragged float32 array with one segment (e.g. the organs) per GU
+
+    All values are stored in a flat buffer and segment i is
+    values[offsets[i]:offsets[i + 1]].
+
+    Parameters
+    ----------
+    lengths : array_like of int
+        Number of values in each segment
+    values : array_like of float, optional
+        Flat values of all segments, zeros if None
+    """
+
+    def __init__(self, lengths=(), values=None):
+        lengths = np.asarray(lengths, dtype=np.int64)
+        self.offsets = np.zeros(lengths.shape[0] + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        if values is None:
+            self.values = np.zeros(self.offsets[-1], dtype=np.float32)
+        else:
+            self.values = np.asarray(values, dtype=np.float32).reshape(-1)
+            assert self.values.shape[0] == self.offsets[-1]
+
+    @classmethod
+    def from_segments(cls, segments):
+        """Create a ragged array from a sequence of sequences (None is an empty segment)
+        """
+        segments = [[] if segment is None else segment for segment in segments]
+        lengths = [len(segment) for segment in segments]
+        values = np.concatenate([np.asarray(segment, dtype=np.float32).reshape(-1) for segment in segments]) if len(segments) else None
+        return cls(lengths, values)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def _indices(self, key):
+        indices = np.arange(len(self))[key]
+        return np.atleast_1d(indices)
+
+    def positions(self, key):
+        """Positions in values of all values of the segments in key (in the order of key)
+        """
+        indices = self._indices(key)
+        lengths = self.offsets[indices + 1] - self.offsets[indices]
+        starts = np.cumsum(lengths) - lengths
+        return np.repeat(self.offsets[indices] - starts, lengths) + np.arange(np.sum(lengths))
+
+    def segment_ids(self, key=slice(None)):
+        """Segment index of each value of the segments in key (in the order of key)
+        """
+        indices = self._indices(key)
+        return np.repeat(indices, self.offsets[indices + 1] - self.offsets[indices])
+
+    def gather(self, key):
+        """Flat values of the segments in key (in the order of key)
+        """
+        return self.values[self.positions(key)]
+
+    def scatter(self, key, values):
+        """Write flat values into the segments in key without changing their lengths
+        """
+        self.values[self.positions(key)] = values
+
+    def sum(self):
+        """Sum of the values of each segment (zero for empty segments)
+        """
+        sums = np.zeros(len(self), dtype=np.float32)
+        is_filled = self.offsets[1:] > self.offsets[:-1]
+        if np.any(is_filled):
+            sums[is_filled] = np.add.reduceat(self.values, self.offsets[:-1][is_filled])
+        return sums
+
+    def resize(self, nb_segments):
+        """Return a ragged array with nb_segments segments, new segments are empty
+        """
+        lengths = np.zeros(nb_segments, dtype=np.int64)
+        nb_kept = min(nb_segments, len(self))
+        lengths[:nb_kept] = self.lengths[:nb_kept]
+        return Ragged(lengths, self.values[:self.offsets[nb_kept]])
+
+    def conform(self, other):
+        """Return a ragged array with the layout of other
+
+        Segments of equal length keep their values, others are filled with zeros.
+        """
+        if np.array_equal(self.offsets, other.offsets):
+            return self
+        ragged = Ragged(other.lengths)
+        nb_common = min(len(self), len(other))
+        is_equal = np.flatnonzero(self.lengths[:nb_common] == other.lengths[:nb_common])
+        ragged.values[ragged.positions(is_equal)] = self.gather(is_equal)
+        return ragged
+
+    def copy(self):
+        ragged = Ragged()
+        ragged.offsets = self.offsets.copy()
+        ragged.values = self.values.copy()
+        return ragged
+
+    def __getitem__(self, key):
+        if np.ndim(key) == 0 and not isinstance(key, slice):
+            return self.values[self.offsets[key]:self.offsets[key + 1]]
+        indices = self._indices(key)
+        return Ragged(self.offsets[indices + 1] - self.offsets[indices], self.gather(indices))
+
+    def __setitem__(self, key, segments):
+        """Replace the segments in key by a sequence of sequences (or a Ragged)
+        """
+        if not isinstance(segments, Ragged):
+            segments = Ragged.from_segments(segments)
+        indices = self._indices(key)
+        assert indices.shape[0] == len(segments)
+        lengths = self.lengths
+        if np.array_equal(lengths[indices], segments.lengths):
+            self.values[self.positions(indices)] = segments.values
+            return
+        is_kept = np.ones(len(self), dtype=bool)
+        is_kept[indices] = False
+        lengths[indices] = segments.lengths
+        ragged = Ragged(lengths)
+        ragged.values[ragged.positions(is_kept)] = self.gather(is_kept)
+        ragged.values[ragged.positions(indices)] = segments.values
+        self.offsets = ragged.offsets
+        self.values = ragged.values
+
+    def __repr__(self):
+        return 'Ragged({} segments, {} values)'.format(len(self), self.values.shape[0])
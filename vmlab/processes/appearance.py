@@ -8,6 +8,7 @@ from . import (
     phenology
 )
 from ._base.parameter import ParameterizedProcess
+from ._base.ragged import Ragged
 
 
 @xs.process
@@ -123,11 +124,6 @@ class Appearance(ParameterizedProcess):
         self.get_final_length_gu = np.vectorize(self.get_final_length_gu, excluded={'rng', 'params'})
         self.get_nb_internode = np.vectorize(self.get_nb_internode, excluded={'params'})
 
-        # np.array of type list
-        self.get_final_length_internodes = np.vectorize(self.get_final_length_internodes, otypes=[object], excluded={'rng', 'params'})
-        self.get_final_length_leaves = np.vectorize(self.get_final_length_leaves, otypes=[object], excluded={'get_final_length_leaf', 'rng', 'params'})
-        self.get_final_length_inflos = np.vectorize(self.get_final_length_inflos, otypes=[object], excluded={'rng', 'params'})
-
         self.get_final_length_leaf = pgl.QuantisedFunction(
             pgl.NurbsCurve2D(
                 pgl.Point3Array([(0, 1, 1), (0.00149779, 1.00072, 1), (1, 0.995671, 1), (1, 0.400121, 1)])
@@ -136,29 +132,20 @@ class Appearance(ParameterizedProcess):
 
         self.appeared = np.ones(self.GU.shape, dtype=np.float32)
         self.nb_internode = np.array(self.nb_internode, dtype=np.float32)
-        self.final_length_internodes = np.full(self.GU.shape, None, dtype=object)
-        self.final_length_leaves = np.full(self.GU.shape, None, dtype=object)
-        self.final_length_inflos = np.full(self.GU.shape, None, dtype=object)
+        self.final_length_internodes = Ragged(np.zeros(self.GU.shape))
+        self.final_length_leaves = Ragged(np.zeros(self.GU.shape))
+        self.final_length_inflos = Ragged(np.zeros(self.GU.shape))
 
         self.run_step(-1)
 
     @xs.runtime(args=('step'))
     def run_step(self, step):
 
-        # can not be automatically resized because be don't want arrays of objects as xs.variables (gives all sorts of issues)
-        if self.final_length_inflos.shape != self.GU.shape:
-            final_length_internodes = np.empty(self.GU.shape, dtype=object)
-            final_length_internodes[0:self.final_length_internodes.shape[0]] = self.final_length_internodes
-            final_length_internodes[self.final_length_internodes.shape[0]:] = None
-            self.final_length_internodes = final_length_internodes
-            final_length_leaves = np.empty(self.GU.shape, dtype=object)
-            final_length_leaves[0:self.final_length_leaves.shape[0]] = self.final_length_leaves
-            final_length_leaves[self.final_length_leaves.shape[0]:] = None
-            self.final_length_leaves = final_length_leaves
-            final_length_inflos = np.empty(self.GU.shape, dtype=object)
-            final_length_inflos[0:self.final_length_inflos.shape[0]] = self.final_length_inflos
-            final_length_inflos[self.final_length_inflos.shape[0]:] = None
-            self.final_length_inflos = final_length_inflos
+        # ragged arrays are not xs.variables and can not be automatically resized, new GUs have no organs
+        if len(self.final_length_inflos) != self.GU.shape[0]:
+            self.final_length_internodes = self.final_length_internodes.resize(self.GU.shape[0])
+            self.final_length_leaves = self.final_length_leaves.resize(self.GU.shape[0])
+            self.final_length_inflos = self.final_length_inflos.resize(self.GU.shape[0])
 
         params = self.parameters
         appeared = (self.appeared_topo == 1.) if step >= 0 else np.full(self.GU.shape, True)
@@ -188,28 +175,32 @@ class Appearance(ParameterizedProcess):
                     params
                 )
 
-            self.final_length_internodes[appeared] = self.get_final_length_internodes(
-                self.is_apical[appeared],
-                self.final_length_gu[appeared],
-                self.nb_internode[appeared],
-                self.rng, params
-            )
+            self.final_length_internodes[appeared] = [
+                self.get_final_length_internodes(is_apical, final_length_gu, nb_internode, self.rng, params)
+                for is_apical, final_length_gu, nb_internode in zip(
+                    self.is_apical[appeared].tolist(),
+                    self.final_length_gu[appeared].tolist(),
+                    self.nb_internode[appeared].tolist()
+                )
+            ]
 
             # leaves
 
-            self.final_length_leaves[appeared] = self.get_final_length_leaves(
-                self.is_apical[appeared],
-                self.nb_internode[appeared],
-                self.get_final_length_leaf, self.rng, params
-            )
+            self.final_length_leaves[appeared] = [
+                self.get_final_length_leaves(is_apical, nb_internode, self.get_final_length_leaf, self.rng, params)
+                for is_apical, nb_internode in zip(
+                    self.is_apical[appeared].tolist(),
+                    self.nb_internode[appeared].tolist()
+                )
+            ]
 
         # inflorescences
 
         if np.any(flowered):
 
-            self.final_length_inflos[flowered] = self.get_final_length_inflos(
-                self.nb_inflo[flowered],
-                self.rng, params
-            )
+            self.final_length_inflos[flowered] = [
+                self.get_final_length_inflos(nb_inflo, self.rng, params)
+                for nb_inflo in self.nb_inflo[flowered].tolist()
+            ]
 
         self.appeared[appeared] = 1.
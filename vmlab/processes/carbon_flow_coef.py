@@ -1,6 +1,5 @@
 import xsimlab as xs
 import numpy as np
-from scipy.sparse import csgraph
 
 from ._base.parameter import ParameterizedProcess
 from . import (
@@ -16,7 +15,7 @@ class CarbonFlowCoef(ParameterizedProcess):
 
     GU = xs.foreign(topology.Topology, 'GU')
     appeared = xs.foreign(topology.Topology, 'appeared')
-    adjacency = xs.foreign(topology.Topology, 'adjacency')
+    tree_index = xs.foreign(topology.Topology, 'tree_index')
     nb_leaf = xs.foreign(growth.Growth, 'nb_leaf')
     nb_fruit = xs.foreign(phenology.Phenology, 'nb_fruit')
     gu_stage = xs.foreign(phenology.Phenology, 'gu_stage')
@@ -24,7 +23,6 @@ class CarbonFlowCoef(ParameterizedProcess):
     harvested = xs.foreign(harvest.Harvest, 'harvested')
 
     # Must be object because it does only store those GU indices on axis 0 that actually bear a fruit
-    # For other purposes there is a full (GUxGU) distance matrix stored in variable 'distances'
     distance_to_fruit = xs.any_object()
     # the only variable that uses nan explicitly (so np.nansum etc. can be used)
     is_in_distance_to_fruit = xs.any_object()
@@ -36,15 +34,6 @@ class CarbonFlowCoef(ParameterizedProcess):
         description='Maximum distance (hops) between source and sink GUs',
         default=3
     )
-    distances = xs.variable(
-        dims=('GU', 'GU_'),
-        intent='out',
-        description='Distance of each leafy GU to all fruit bearing GUs where no hops <= max_distance_to_fruit',
-        attrs={
-            'fill_value': np.inf,
-            'unit': 'no hops'
-        }
-    )
 
     def initialize(self):
 
@@ -54,7 +43,6 @@ class CarbonFlowCoef(ParameterizedProcess):
         self.is_in_distance_to_fruit = np.array([], dtype=np.bool)
         self.allocation_share = np.array([], dtype=np.float32)
         self.is_photo_active = np.zeros(self.GU.shape, dtype=np.float32)
-        self.distances = np.full((self.GU.shape[0], self.GU.shape[0]), np.inf, dtype=np.float32)
 
     @xs.runtime(args=())
     def run_step(self):
@@ -65,15 +53,12 @@ class CarbonFlowCoef(ParameterizedProcess):
         if np.any(is_fruting):
 
             if np.any((self.appeared == 1.) | (self.fruited == 1.) | (self.harvested == 1.)):
-                self.distance_to_fruit = csgraph.shortest_path(
-                    self.adjacency,
-                    indices=np.flatnonzero(is_fruting),
-                    directed=False
+                self.distance_to_fruit = self.tree_index.distance(
+                    np.vstack(np.flatnonzero(is_fruting)),
+                    self.GU
                 ).astype(np.float32)
-                self.distances[:] = np.inf
 
             self.distance_to_fruit[self.distance_to_fruit > self.max_distance_to_fruit] = np.inf
-            self.distances[np.flatnonzero(is_fruting), :] = self.distance_to_fruit
             self.distance_to_fruit[:, np.flatnonzero(~is_leafy)] = np.inf
 
             self.is_in_distance_to_fruit = np.isfinite(self.distance_to_fruit).astype(np.float32)
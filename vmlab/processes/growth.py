@@ -1,6 +1,5 @@
 import xsimlab as xs
 import numpy as np
-import typing
 
 from . import topology, phenology, appearance
 from ._base.parameter import ParameterizedProcess
@@ -79,15 +78,13 @@ class Growth(ParameterizedProcess):
         }
     )
 
-    def get_length_inflos(self, final_length_inflos: typing.List[float], inflo_growth_tts, params):
-        final_length_inflos = np.array(final_length_inflos)
-        return (final_length_inflos / (1. + np.exp(-(inflo_growth_tts - params.t_ip_inflo) / params.B_inflo))).tolist()
+    def get_length_inflos(self, final_length_inflos, inflo_growth_tts, params):
+        return final_length_inflos / (1. + np.exp(-(inflo_growth_tts - params.t_ip_inflo) / params.B_inflo))
 
-    def get_length_leaves(self, final_length_leaves: typing.List[float], leaf_growth_tts, params):
-        final_length_leaves = np.array(final_length_leaves)
+    def get_length_leaves(self, final_length_leaves, leaf_growth_tts, params):
         max_growth_rate = -0.0188725 + 0.0147985 * final_length_leaves * 4
         B = final_length_leaves / max_growth_rate
-        return (final_length_leaves / (1. + np.exp(-(leaf_growth_tts - params.t_ip_leaf) / B))).tolist()
+        return final_length_leaves / (1. + np.exp(-(leaf_growth_tts - params.t_ip_leaf) / B))
 
     def initialize(self):
 
@@ -101,10 +98,6 @@ class Growth(ParameterizedProcess):
         max_leafy_diameter_gu = params.max_leafy_diameter_gu
         params.t_ip_gu = self.rng.normal(params.t_ip_gu_mean, params.t_ip_gu_sd)
 
-        # np.array of type list
-        self.get_length_inflos = np.vectorize(self.get_length_inflos, otypes=[object], excluded={'params'})
-        self.get_length_leaves = np.vectorize(self.get_length_leaves, otypes=[object], excluded={'leaf_growth_tts', 'params'})
-
         radius_gu_isnan = np.isnan(self.radius_gu)
         self.radius_gu[radius_gu_isnan] = (radius_coefficient_gu * (self.nb_descendants[radius_gu_isnan] + 1) ** radius_exponent_gu).astype(np.float32)
         self.radius_inflo = np.zeros(self.GU.shape, dtype=np.float32)
@@ -121,15 +114,9 @@ class Growth(ParameterizedProcess):
     @xs.runtime(args=('step'))
     def run_step(self, step):
 
-        if self.length_leaves.shape != self.GU.shape:
-            length_leaves = np.empty(self.GU.shape, dtype=object)
-            length_leaves[0:self.length_leaves.shape[0]] = self.length_leaves
-            length_leaves[self.length_leaves.shape[0]:] = None
-            self.length_leaves = length_leaves
-            length_inflos = np.empty(self.GU.shape, dtype=object)
-            length_inflos[0:self.length_inflos.shape[0]] = self.length_inflos
-            length_inflos[self.length_inflos.shape[0]:] = None
-            self.length_inflos = length_inflos
+        # organs of new or reinitialized GUs have not grown yet
+        self.length_leaves = self.length_leaves.conform(self.final_length_leaves)
+        self.length_inflos = self.length_inflos.conform(self.final_length_inflos)
 
         gu_growing = (self.gu_stage > 0.) & (self.gu_stage < self.nb_gu_stage) & (self.appeared == 1.)
         inflo_growing = (self.inflo_stage > 0.) & (self.inflo_stage < self.nb_inflo_stage) & (self.appeared == 1.)
@@ -153,11 +140,12 @@ class Growth(ParameterizedProcess):
                 -(self.gu_growth_tts[gu_growing] - params.t_ip_gu) / params.B_gu
             ))
 
-            self.length_leaves[gu_growing] = self.get_length_leaves(
-                self.final_length_leaves[gu_growing],
-                self.leaf_growth_tts[gu_growing],
+            # all leaves of all growing GUs at once
+            self.length_leaves.scatter(gu_growing, self.get_length_leaves(
+                self.final_length_leaves.gather(gu_growing),
+                np.repeat(self.leaf_growth_tts[gu_growing], self.final_length_leaves.lengths[gu_growing]),
                 params
-            )
+            ))
 
         if np.any(inflo_growing):
 
@@ -166,11 +154,11 @@ class Growth(ParameterizedProcess):
 
             self.radius_inflo[inflo_growing] = radius_coefficient_inflo + radius_slope_inflo * (self.inflo_stage[inflo_growing] / self.nb_inflo_stage)
 
-            self.length_inflos[inflo_growing] = self.get_length_inflos(
-                self.final_length_inflos[inflo_growing],
-                self.inflo_growth_tts[inflo_growing],
+            self.length_inflos.scatter(inflo_growing, self.get_length_inflos(
+                self.final_length_inflos.gather(inflo_growing),
+                np.repeat(self.inflo_growth_tts[inflo_growing], self.final_length_inflos.lengths[inflo_growing]),
                 params
-            )
+            ))
 
         if self.leaf_senescence_enabled:
             self.nb_leaf[self.radius_gu * 2. >= params.max_leafy_diameter_gu] = 0.
@@ -1,41 +1,337 @@
 import xsimlab as xs
 import numpy as np
-from scipy.sparse import csgraph
+from scipy import sparse
 import openalea.lpy as lpy
 import pathlib
 
 from ._base.parameter import ParameterizedProcess
 
 
+def get_children(parent):
+    """Children of all GUs in compressed sparse row (CSR) form
+
+    Parameters
+    ----------
+    parent : :class:`numpy.ndarray`
+        Index of the parent of each GU, -1 for the root
+
+    Returns
+    -------
+    offsets, children : tuple of :class:`numpy.ndarray`
+        The children of GU idx are children[offsets[idx]:offsets[idx + 1]]
+        in ascending order.
+    """
+    parent = np.asarray(parent)
+    children = np.flatnonzero(parent >= 0)
+    children = children[np.argsort(parent[children], kind='stable')]
+    offsets = np.zeros(parent.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(parent[children], minlength=parent.shape[0]), out=offsets[1:])
+    return offsets, children
+
+
+def get_adjacency(parent, dense=False):
+    """Adjacency matrix (parent x child) of the tree
+
+    Only meant for analyses and algorithms that require a matrix.
+    The topology is stored as parent indices in 'topology__parent'.
+
+    Parameters
+    ----------
+    parent : :class:`numpy.ndarray`
+        Index of the parent of each GU, -1 for the root
+    dense : boolean, optional
+        If true returns a dense float32 array instead of a sparse matrix
+
+    Returns
+    -------
+    adjacency : :class:`scipy.sparse.csr_matrix` or :class:`numpy.ndarray`
+    """
+    parent = np.asarray(parent, dtype=np.int64)
+    nb_gu = parent.shape[0]
+    children = np.flatnonzero(parent >= 0)
+    adjacency = sparse.csr_matrix(
+        (np.ones(children.shape, dtype=np.float32), (parent[children], children)),
+        shape=(nb_gu, nb_gu)
+    )
+    return adjacency.toarray() if dense else adjacency
+
+
+def get_depth(parent):
+    """Number of edges between each GU and its root
+
+    Parameters
+    ----------
+    parent : :class:`numpy.ndarray`
+        Index of the parent of each GU, -1 for the root
+
+    Returns
+    -------
+    depth : :class:`numpy.ndarray`
+        -1 for GUs that are not connected to a root (i.e. part of a cycle)
+    """
+    parent = np.asarray(parent)
+    offsets, children = get_children(parent)
+    depth = np.full(parent.shape, -1, dtype=np.int64)
+    level = np.flatnonzero(parent < 0)
+    depth[level] = 0
+    # breadth-first, one level at a time
+    while level.shape[0]:
+        nb_children = offsets[level + 1] - offsets[level]
+        starts = np.repeat(offsets[level] - np.cumsum(nb_children) + nb_children, nb_children)
+        level = children[starts + np.arange(starts.shape[0])]
+        depth[level] = depth[parent[level]] + 1
+    return depth
+
+
+def add_descendants(nb_descendants, parent, gus):
+    """Increment in place the number of descendants of all ancestors of gus
+
+    Costs O(len(gus) * depth) i.e. it does not depend on the size of the tree.
+
+    Parameters
+    ----------
+    nb_descendants : :class:`numpy.ndarray`
+        Number of descendants of each GU
+    parent : :class:`numpy.ndarray`
+        Index of the parent of each GU, -1 for the root
+    gus : :class:`numpy.ndarray`
+        Indices of GUs to be added as descendants
+    """
+    ancestors = parent[gus]
+    ancestors = ancestors[ancestors >= 0]
+    while ancestors.shape[0]:
+        np.add.at(nb_descendants, ancestors, 1.)
+        ancestors = parent[ancestors]
+        ancestors = ancestors[ancestors >= 0]
+
+
+def get_subtree_size(parent, depth):
+    """Number of GUs in the subtree of each GU (including the GU itself)
+    """
+    size = np.ones(parent.shape, dtype=np.int64)
+    by_depth = np.argsort(depth, kind='stable')
+    bounds = np.searchsorted(depth[by_depth], np.arange(np.max(depth, initial=0) + 2))
+    for level in range(bounds.shape[0] - 2, 0, -1):
+        gus = by_depth[bounds[level]:bounds[level + 1]]
+        np.add.at(size, parent[gus], size[gus])
+    return size
+
+
+def get_preorder(parent, depth, size, key=None):
+    """Position of each GU in a depth-first (pre-order) traversal
+
+    Roots and siblings are visited in ascending order of their indices.
+    If key is given siblings are visited in ascending order of key first.
+    """
+    preorder = np.zeros(parent.shape, dtype=np.int64)
+    by_depth = np.argsort(depth, kind='stable')
+    bounds = np.searchsorted(depth[by_depth], np.arange(np.max(depth, initial=0) + 2))
+    roots = by_depth[bounds[0]:bounds[1]]
+    preorder[roots] = np.cumsum(size[roots]) - size[roots]
+    for level in range(1, bounds.shape[0] - 1):
+        gus = by_depth[bounds[level]:bounds[level + 1]]
+        if key is None:
+            gus = gus[np.lexsort((gus, parent[gus]))]
+        else:
+            gus = gus[np.lexsort((gus, key[gus], parent[gus]))]
+        parents = parent[gus]
+        # offset of each GU within its siblings: exclusive cumsum of their subtree sizes
+        offset = np.cumsum(size[gus]) - size[gus]
+        is_first = np.ones(gus.shape, dtype=bool)
+        is_first[1:] = parents[1:] != parents[:-1]
+        first = np.maximum.accumulate(np.where(is_first, np.arange(gus.shape[0]), 0))
+        preorder[gus] = preorder[parents] + 1 + offset - offset[first]
+    return preorder
+
+
+class TreeIndex:
+    """Lowest common ancestor (LCA) and distance queries on a growing tree
+
+    The index is an Euler tour of the tree and a sparse table of the minimum
+    depth over any power-of-two range of the tour. It is built in O(N log N)
+    and answers each (vectorized) query in O(1). GUs added with extend are
+    attached to their closest indexed ancestor (anchor) and the index is only
+    rebuilt once the number of these pending GUs exceeds rebuild_ratio times
+    the number of indexed GUs.
+
+    Several roots (a forest) are allowed: GUs of different trees have no
+    common ancestor (-1) and an infinite distance.
+
+    Parameters
+    ----------
+    parent : :class:`numpy.ndarray`
+        Index of the parent of each GU, -1 for a root
+    rebuild_ratio : float, optional
+    """
+
+    def __init__(self, parent, rebuild_ratio=0.5):
+        self.rebuild_ratio = rebuild_ratio
+        self.parent = np.array(parent, dtype=np.int64)
+        self.depth = get_depth(self.parent)
+        self._build()
+
+    def __len__(self):
+        return self.parent.shape[0]
+
+    def _build(self):
+        nb_gu = self.parent.shape[0]
+        # a virtual root joins all trees
+        parent = np.append(np.where(self.parent >= 0, self.parent, nb_gu), -1)
+        depth = np.append(self.depth + 1, 0)
+        size = get_subtree_size(parent, depth)
+        first = 2 * get_preorder(parent, depth, size) - depth
+        euler = np.empty(2 * nb_gu + 1, dtype=np.int32)
+        euler[first] = np.arange(nb_gu + 1)
+        # after the subtree of a GU the tour returns to its parent
+        euler[first[:-1] + 2 * size[:-1] - 1] = parent[:-1]
+        euler_depth = depth[euler]
+        nb_levels = int(np.log2(euler.shape[0])) + 1
+        table = np.empty((nb_levels, euler.shape[0]), dtype=np.int32)
+        table[0] = np.arange(euler.shape[0])
+        for level in range(1, nb_levels):
+            left = table[level - 1]
+            right = left[np.minimum(np.arange(euler.shape[0]) + (1 << (level - 1)), euler.shape[0] - 1)]
+            table[level] = np.where(euler_depth[left] <= euler_depth[right], left, right)
+        self._first = first
+        self._euler = euler
+        self._euler_depth = euler_depth
+        self._table = table
+        self._log2 = np.log2(np.maximum(np.arange(euler.shape[0] + 1), 1)).astype(np.int64)
+        self._anchor = np.arange(nb_gu, dtype=np.int64)
+        self._nb_indexed = nb_gu
+
+    def _lca_indexed(self, u, v):
+        lo = np.minimum(self._first[u], self._first[v])
+        hi = np.maximum(self._first[u], self._first[v])
+        level = self._log2[hi - lo + 1]
+        a = self._table[level, lo]
+        b = self._table[level, hi - np.left_shift(1, level) + 1]
+        return self._euler[np.where(self._euler_depth[a] <= self._euler_depth[b], a, b)].astype(np.int64)
+
+    def _climb(self, u, v):
+        u = u.copy()
+        v = v.copy()
+        diff = self.depth[u] - self.depth[v]
+        while np.any(diff != 0):
+            u[diff > 0] = self.parent[u[diff > 0]]
+            v[diff < 0] = self.parent[v[diff < 0]]
+            diff = self.depth[u] - self.depth[v]
+        differ = u != v
+        while np.any(differ):
+            u[differ] = self.parent[u[differ]]
+            v[differ] = self.parent[v[differ]]
+            # roots of different trees have no common ancestor (-1)
+            differ = (u != v) & (u >= 0) & (v >= 0)
+        u[v < 0] = -1
+        return u
+
+    def extend(self, parent):
+        """Append new GUs given the indices of their parents
+
+        A parent must have a lower index than its children. GUs without a
+        parent (-1) are new roots.
+        """
+        parent = np.asarray(parent, dtype=np.int64)
+        new = np.arange(self.parent.shape[0], self.parent.shape[0] + parent.shape[0])
+        assert np.all(parent < new)
+        self.parent = np.append(self.parent, parent)
+        self.depth = np.append(self.depth, np.zeros(parent.shape, dtype=np.int64))
+        self._anchor = np.append(self._anchor, np.full(parent.shape, -1, dtype=np.int64))
+        # new roots hang below the virtual root until the next build
+        self._anchor[new[parent < 0]] = self._nb_indexed
+        new = new[parent >= 0]
+        # parents of new GUs may be new GUs as well
+        while new.shape[0]:
+            parent = self.parent[new]
+            ready = self._anchor[parent] >= 0
+            self.depth[new[ready]] = self.depth[parent[ready]] + 1
+            self._anchor[new[ready]] = self._anchor[parent[ready]]
+            new = new[~ready]
+        if self.parent.shape[0] - self._nb_indexed > self.rebuild_ratio * self._nb_indexed:
+            self._build()
+
+    def lca(self, u, v):
+        """Lowest common ancestor of GUs u and v (broadcasted), -1 if they belong to different trees
+        """
+        u, v = np.broadcast_arrays(np.asarray(u, dtype=np.int64), np.asarray(v, dtype=np.int64))
+        anchor_u = self._anchor[u]
+        anchor_v = self._anchor[v]
+        lca = self._lca_indexed(anchor_u, anchor_v)
+        lca[lca == self._nb_indexed] = -1
+        # pending GUs below the same anchor: walk up to the common ancestor
+        climb = (anchor_u == anchor_v) & ((u >= self._nb_indexed) | (v >= self._nb_indexed))
+        if np.any(climb):
+            lca[climb] = self._climb(u[climb], v[climb])
+        return lca
+
+    def distance(self, u, v):
+        """Number of edges between GUs u and v (broadcasted), inf if they belong to different trees
+        """
+        u, v = np.broadcast_arrays(np.asarray(u, dtype=np.int64), np.asarray(v, dtype=np.int64))
+        lca = self.lca(u, v)
+        distance = np.full(lca.shape, np.inf)
+        found = lca >= 0
+        distance[found] = self.depth[u[found]] + self.depth[v[found]] - 2 * self.depth[lca[found]]
+        return distance
+
+
 @xs.process
 class Topology(ParameterizedProcess):
 
     lsystem = None
+    _use_lpy = True
+    _children = None
+    # position of the A(idx) module of each GU in lstring, -1 if none
+    _a_position = None
+    # index of the first GU not yet accounted for in nb_descendants
+    _idx_pending = 0
 
     archdev = xs.group_dict('arch_dev')
 
     seed = xs.variable(default=0, static=True, global_name='seed')
+    engine = xs.variable(
+        default='auto',
+        static=True,
+        description="Topology engine: 'lpy', 'numpy' or 'auto' (lpy only if a process consumes lstring)"
+    )
     month_begin_veg_cycle = xs.variable(default=7, intent='in', static=True)
     doy_begin_flowering = xs.variable(default=214, intent='in', static=True)
 
     sim_start_date = xs.variable(intent='inout', static=True)
     GU = xs.index(dims='GU')
-    GU_ = xs.index(dims='GU_')
     # make an inout variable so it is ignored in process ordering
     nb_gu = xs.variable(intent='inout', default=0, static=True, global_name='nb_gu')
 
     lstring = xs.any_object()
+    tree_index = xs.any_object(
+        description='A TreeIndex instance to query distances (no. hops) between GUs'
+    )
 
     current_cycle = xs.variable(intent='inout')
-    adjacency = xs.variable(dims=('GU', 'GU_'), intent='inout')
+    parent = xs.variable(
+        dims='GU',
+        intent='inout',
+        description='Index of the parent GU, -1 for the root',
+        encoding={
+            'fill_value': -1
+        }
+    )
     ancestor_is_apical = xs.variable(dims='GU', intent='inout')
     ancestor_nature = xs.variable(dims='GU', intent='inout')
     is_apical = xs.variable(dims='GU', intent='inout')
     appearance_month = xs.variable(dims='GU', intent='inout')
     cycle = xs.variable(dims='GU', intent='inout')
+    tree = xs.variable(
+        dims='GU',
+        intent='inout',
+        description='Index of the tree of each GU if several trees are simulated at once (forest), -1 if unknown',
+        encoding={
+            'fill_value': -1
+        }
+    )
 
     appearance_date = xs.variable(dims='GU', intent='out')
-    distance = xs.variable(dims=('GU', 'GU_'), intent='out')
+    depth = xs.variable(dims='GU', intent='out', description='Number of GUs between a GU and the root')
     bursted = xs.variable(dims='GU', intent='out')
     appeared = xs.variable(dims='GU', intent='out')
     nb_descendants = xs.variable(dims='GU', intent='out')
@@ -43,15 +339,23 @@ class Topology(ParameterizedProcess):
     parent_is_apical = xs.variable(dims='GU', intent='out')
     is_initially_terminal = xs.variable(dims='GU', intent='out')
 
+    def children(self, idx):
+        """Indices of the children of GU idx in ascending order
+        """
+        if self._children is None:
+            self._children = get_children(self.parent)
+        offsets, children = self._children
+        return children[offsets[idx]:offsets[idx + 1]]
+
     @xs.runtime(args=('nsteps', 'step_start'))
     def initialize(self, nsteps, step_start):
 
         super(Topology, self).initialize()
 
+        self._children = None
         self.sim_start_date = np.datetime64(self.sim_start_date)
-        self.adjacency = np.array(self.adjacency, dtype=np.float32)
-        self.GU = np.array([x for x in range(self.adjacency.shape[0])], dtype=np.int32)
-        self.GU_ = self.GU
+        self.parent = np.array(self.parent, dtype=np.int32)
+        self.GU = np.array([x for x in range(self.parent.shape[0])], dtype=np.int32)
         self.nb_gu = self.GU.shape[0]
 
         self.ancestor_is_apical = np.array(self.ancestor_is_apical, dtype=np.float32)
@@ -60,24 +364,43 @@ class Topology(ParameterizedProcess):
         self.is_apical[np.isnan(self.is_apical)] = 0.0
         self.appearance_month = np.array(self.appearance_month, dtype=np.float32)
         self.cycle = np.array(self.cycle, dtype=np.float32)
+        self.tree = np.array(self.tree, dtype=np.float32)
+        self.tree[np.isnan(self.tree)] = 0.
 
-        self.distance = csgraph.shortest_path(csgraph.csgraph_from_dense(self.adjacency)).astype(np.float32)
-        self.nb_descendants = np.count_nonzero(~np.isinf(self.distance) & (self.distance > 0.), axis=1).astype(np.float32)
+        self.tree_index = TreeIndex(self.parent)
+        self.depth = self.tree_index.depth.astype(np.float32)
+        self.nb_descendants = np.zeros(self.GU.shape, dtype=np.float32)
+        add_descendants(self.nb_descendants, self.parent, self.GU)
+        self._idx_pending = self.GU.shape[0]
 
         self.appearance_date = np.full(self.GU.shape, np.datetime64('NaT'), dtype='datetime64[D]')
         self.parent_is_apical = np.full(self.GU.shape, 1., dtype=np.float32)
         self.ancestor = np.full(self.GU.shape, 0., dtype=np.float32)
-        self.parent_is_apical[np.argwhere(self.adjacency)[:, 1]] = self.is_apical[np.argwhere(self.adjacency)[:, 0]]
+        has_parent = self.parent >= 0
+        self.parent_is_apical[has_parent] = self.is_apical[self.parent[has_parent]]
 
         self.bursted = np.zeros(self.GU.shape, dtype=np.float32)
         self.appeared = np.zeros(self.GU.shape, dtype=np.float32)
 
-        self.lsystem = lpy.Lsystem(str(pathlib.Path(__file__).parent.joinpath('topology.lpy')), {
-            'process': self,
-            'derivation_length': int(nsteps)
-        })
+        assert self.engine in ('auto', 'lpy', 'numpy')
+        if self.engine == 'auto':
+            self._use_lpy = self._lstring_is_consumed()
+        else:
+            self._use_lpy = self.engine == 'lpy'
 
-        self.lstring = self.lsystem.derive(self.lsystem.axiom, 0, int(np.max(self.distance[np.isfinite(self.distance)])))
+        if self._use_lpy:
+            self.lsystem = lpy.Lsystem(str(pathlib.Path(__file__).parent.joinpath('topology.lpy')), {
+                'process': self,
+                'derivation_length': int(nsteps)
+            })
+            self.lstring = self.lsystem.derive(self.lsystem.axiom, 0, int(np.max(self.depth)))
+            self._a_position = np.full(self.GU.shape, -1, dtype=np.int64)
+            for position, module in enumerate(self.lstring):
+                if module.name == 'A':
+                    self._a_position[module[0]] = position
+        else:
+            self.lsystem = None
+            self.lstring = None
         self.is_initially_terminal = (self.cycle == np.nanmax(self.cycle)) & (self.nb_descendants == 0.)
 
     @xs.runtime(args=('step', 'step_start', 'nsteps'))
@@ -98,17 +421,137 @@ class Topology(ParameterizedProcess):
 
         if np.any(self.bursted):
             total_nb_children = np.sum(self.archdev[('arch_dev', 'pot_nb_lateral_children')][self.bursted == 1.] + self.archdev[('arch_dev', 'pot_has_apical_child')][self.bursted == 1.])
-            self.idx_first_child = self.GU.shape[0]
+            # _burst advances idx_first_child: keep the index of the first new GU
+            # to extend tree_index and depth with the new GUs
+            idx_first_child = self.idx_first_child = self.GU.shape[0]
+            self._add_pending()
             self.GU = np.append(self.GU, np.array([i + self.GU.shape[0] for i in range(int(total_nb_children))], np.int32))
-            self.GU_ = self.GU
             self.nb_gu = self.GU.shape[0]
             # initialize new GUs
             step_date = step_start.astype('datetime64[D]')
-            self.appearance_month[self.idx_first_child:] = step_date.item().month
-            self.appearance_date[self.idx_first_child:] = step_date
-            self.appeared[self.idx_first_child:] = 1.
-            self.adjacency[np.isnan(self.adjacency)] = 0.
-            self.cycle[self.idx_first_child:] = self.current_cycle
-            self.distance = csgraph.shortest_path(csgraph.csgraph_from_dense(self.adjacency)).astype(np.float32)
-            self.lstring = self.lsystem.derive(self.lstring, step, 1)
-            self.nb_descendants = np.count_nonzero(~np.isinf(self.distance) & (self.distance > 0.), axis=1).astype(np.float32)
+            self.appearance_month[idx_first_child:] = step_date.item().month
+            self.appearance_date[idx_first_child:] = step_date
+            self.appeared[idx_first_child:] = 1.
+            self.cycle[idx_first_child:] = self.current_cycle
+            bursting, nb_children = self._burst()
+            if self._use_lpy:
+                self._splice(bursting, nb_children, idx_first_child)
+            self._children = None
+            self.tree_index.extend(self.parent[idx_first_child:])
+            self.depth[idx_first_child:] = self.tree_index.depth[idx_first_child:]
+
+    def _checkpoint(self):
+        """Values a checkpoint can not pickle: the lstring as a string
+        """
+        return {'lstring': None if self.lstring is None else str(self.lstring)}
+
+    def _restore(self, values):
+        if values['lstring'] is not None:
+            self.lstring = lpy.AxialTree(values['lstring'])
+
+    def _lstring_is_consumed(self):
+        """True if any other process of the model uses lstring
+        """
+        key = self.__xsimlab_state_keys__['lstring']
+        return any(
+            p_obj is not self and key in p_obj.__xsimlab_state_keys__.values()
+            for p_obj in self.__xsimlab_model__.values()
+        )
+
+    def _burst(self):
+        """Create the children of all bursting GUs
+
+        Only terminal GUs of a tree bear an A module in the lstring and children
+        are numbered in lstring order, i.e. depth-first with lateral children before the
+        apical child.
+
+        Returns
+        -------
+        bursting, nb_children : tuple of :class:`numpy.ndarray`
+            Indices of the bursting GUs in lstring order and their number of children
+        """
+        nb_lateral_children = self.archdev[('arch_dev', 'pot_nb_lateral_children')]
+        has_apical_child = self.archdev[('arch_dev', 'pot_has_apical_child')]
+        nature = self.archdev[('arch_dev', 'pot_nature')]
+
+        nb_gu = self.idx_first_child
+        parent = self.parent[:nb_gu]
+        depth = self.tree_index.depth[:nb_gu]
+        is_terminal = np.bincount(parent[parent >= 0], minlength=nb_gu) == 0
+        bursting = np.flatnonzero((self.bursted[:nb_gu] == 1.) & is_terminal)
+        # GUs that did not get a parent are not part of any tree
+        bursting = bursting[self.tree[bursting] >= 0.]
+        preorder = get_preorder(parent, depth, get_subtree_size(parent, depth), key=self.is_apical[:nb_gu])
+        bursting = bursting[np.argsort(preorder[bursting])]
+
+        nb_children = (nb_lateral_children[bursting] + has_apical_child[bursting]).astype(np.int64)
+        idx_parent = np.repeat(bursting, nb_children)
+        idx_child = nb_gu + np.arange(idx_parent.shape[0])
+
+        # apical child comes last
+        is_last = np.zeros(idx_parent.shape, dtype=bool)
+        is_last[(np.cumsum(nb_children) - 1)[nb_children > 0]] = True
+        self.is_apical[idx_child] = (is_last & (has_apical_child[idx_parent] == 1.)).astype(np.float32)
+
+        is_new_cycle = self.current_cycle != self.cycle[idx_parent]
+        self.ancestor[idx_child] = np.where(is_new_cycle, idx_parent, self.ancestor[idx_parent])
+        self.ancestor_is_apical[idx_child] = np.where(is_new_cycle, self.is_apical[idx_parent], self.ancestor_is_apical[idx_parent])
+        self.ancestor_nature[idx_child] = np.where(is_new_cycle, nature[idx_parent], self.ancestor_nature[idx_parent])
+        self.parent[idx_child] = idx_parent
+        self.parent_is_apical[idx_child] = self.is_apical[idx_parent]
+        self.tree[idx_child] = self.tree[idx_parent]
+        self.idx_first_child = nb_gu + idx_parent.shape[0]
+
+        return bursting, nb_children
+
+    def _splice(self, bursting, nb_children, idx_first_child):
+        """Replace the A modules of bursting GUs in lstring by the modules of their children
+
+        Gives the same lstring as a derivation step in which the A modules of bursting GUs
+        produce their children. No production is called for the other GUs, but each splice
+        still moves the modules that follow it in lstring.
+        """
+        has_apical_child = self.archdev[('arch_dev', 'pot_has_apical_child')]
+        burst_modules = self.lsystem.context()['burst_modules']
+
+        # a GU without children keeps its A module
+        is_spliced = nb_children > 0
+        first_child = (idx_first_child + np.cumsum(nb_children) - nb_children)[is_spliced]
+        bursting = bursting[is_spliced]
+        nb_children = nb_children[is_spliced]
+        positions = self._a_position[bursting]
+        assert np.all(positions >= 0) and np.all(np.diff(positions) > 0)
+
+        blocks = [
+            burst_modules(int(first), int(nb), has_apical_child[idx])
+            for idx, first, nb in zip(bursting, first_child, nb_children)
+        ]
+        # splice from the end so that the positions of preceding modules remain valid
+        for position, block in zip(positions[::-1], blocks[::-1]):
+            del self.lstring[int(position)]
+            self.lstring.insertAt(int(position), block)
+
+        # shift positions of all remaining A modules by the length added before them
+        a_position = np.full(self.GU.shape, -1, dtype=np.int64)
+        a_position[:self._a_position.shape[0]] = self._a_position
+        a_position[bursting] = -1
+        added = np.zeros(positions.shape[0] + 1, dtype=np.int64)
+        np.cumsum([len(block) - 1 for block in blocks], out=added[1:])
+        has_a = np.flatnonzero(a_position >= 0)
+        a_position[has_a] += added[np.searchsorted(positions, a_position[has_a])]
+        for position, shift, first, block in zip(positions, added, first_child, blocks):
+            offsets = [i for i, module in enumerate(block) if module.name == 'A']
+            a_position[first:first + len(offsets)] = position + shift + np.array(offsets)
+        self._a_position = a_position
+
+    def _add_pending(self):
+        """Add GUs that appeared at the previous burst to nb_descendants.
+
+        nb_descendants lags one burst behind the topology (it used to be computed
+        before new GUs were attached). Since new GUs are always leaves only the
+        counts of their ancestors need an update.
+        """
+        pending = self.GU[self._idx_pending:self.idx_first_child]
+        if pending.shape[0]:
+            add_descendants(self.nb_descendants, self.parent, pending)
+        self._idx_pending = self.idx_first_child
@@ -0,0 +1,160 @@
+import warnings
+import numpy as np
+import xarray as xr
+import xsimlab as xs
+
+
+# reductions over GUs and their value for no GUs
+reductions = {
+    'sum': (np.nansum, 0.),
+    'mean': (np.nanmean, np.nan),
+    'max': (np.nanmax, np.nan),
+    'min': (np.nanmin, np.nan),
+    'count_nonzero': (lambda values: np.count_nonzero(values[~np.isnan(values)]), 0)
+}
+
+# cumulative reductions over the clock
+cumulatives = {
+    'cumsum': ('sum', np.nancumsum),
+    'cumcount_nonzero': ('count_nonzero', np.cumsum),
+    'cummax': ('max', np.fmax.accumulate),
+    'cummin': ('min', np.fmin.accumulate)
+}
+
+
+def parse_reducer(name, item, clocks, model):
+    """Check a reducer of an output variable
+
+    Parameters
+    ----------
+    name : str
+        Name of the output variable ('foo__bar') with dimensions ('GU',)
+    item : tuple
+        (clock, reduction) or (clock, reduction, by) where reduction is one of 'sum', 'mean', 'max',
+        'min', 'count_nonzero' or a cumulative form ('cumsum', 'cumcount_nonzero', 'cummax', 'cummin')
+        and by the name of a variable with dimensions ('GU',) to group the GUs by its values
+    clocks : list
+        Clocks of the setup
+    model : :class:`xsimlab.Model` object
+
+    Returns
+    -------
+    str
+        'name,clock,reduction,by' (clock and by may be empty) to be stored as attribute of a dataset
+    """
+    assert 2 <= len(item) <= 3, f'reducer of {name} must be (clock, reduction) or (clock, reduction, by)'
+    clock, how, by = tuple(item) + (None,) * (3 - len(item))
+    assert clock is None or clock in clocks, f'unknown clock {clock}'
+    assert how in reductions or how in cumulatives, f'unknown reduction {how}'
+    assert clock is not None or how not in cumulatives, 'cumulative reductions require a clock'
+    for var_name in (name, by):
+        if var_name is None:
+            continue
+        p_name, v_name = var_name.split('__')
+        dims = xs.filter_variables(model[p_name])[v_name].metadata['dims']
+        assert ('GU',) in dims, f'{var_name} has no dimensions (GU,)'
+    return ','.join([name, clock or '', how, by or ''])
+
+
+class OutputReducer(xs.RuntimeHook):
+    """Runtime hook that records reductions over the GUs of output variables instead of their values
+
+    The variables are reduced after each 'run_step' like xarray-simlab records the snapshots of
+    the output variables and once more at the end of the simulation. Only the reduced values
+    are kept. Reductions grouped by a variable (e.g. 'topology__cycle' or 'arch_dev_rep__nature')
+    get a dimension named like the variable (e.g. 'cycle') with all values that occurred.
+
+    Parameters
+    ----------
+    reducers : list of str
+        'name,clock,reduction,by' of each variable (see parse_reducer), an empty
+        clock records the end of the simulation only and an empty by reduces all GUs
+    """
+
+    def __init__(self, reducers):
+        super().__init__()
+        self.reducers = [tuple(reducer.split(',')) for reducer in reducers]
+        self._clear()
+
+    def _clear(self):
+        self.days = []
+        self.values = {reducer[0]: [] for reducer in self.reducers}
+
+    @staticmethod
+    def _reduce(how, values, groups=None):
+        how = cumulatives[how][0] if how in cumulatives else how
+        func, empty = reductions[how]
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+
+        def reduce(selected):
+            if selected.shape[0] == 0:
+                return empty
+            with warnings.catch_warnings():
+                # all-NaN slices
+                warnings.simplefilter('ignore', RuntimeWarning)
+                return float(func(selected))
+
+        if groups is None:
+            return reduce(values)
+        groups = np.asarray(groups)
+        return {group: reduce(values[groups == group]) for group in np.unique(groups[~np.isnan(groups)]).tolist()}
+
+    def _record(self, state, day):
+        self.days.append(day)
+        for name, clock, how, by in self.reducers:
+            p_name, v_name = name.split('__')
+            groups = None
+            if by:
+                by_p_name, by_v_name = by.split('__')
+                groups = np.asarray(state[(by_p_name, by_v_name)], dtype=np.float64)
+            self.values[name].append(self._reduce(how, state[(p_name, v_name)], groups))
+
+    @xs.runtime_hook('initialize', 'model', 'pre')
+    def _reset(self, model, context, state):
+        self._clear()
+
+    @xs.runtime_hook('run_step', 'model', 'post')
+    def _record_step(self, model, context, state):
+        self._record(state, context['step_start'])
+
+    @xs.runtime_hook('finalize', 'model', 'pre')
+    def _record_end(self, model, context, state):
+        self._record(state, context['sim_end'])
+
+    def to_dataset(self):
+        """Reduced variables as a Dataset with dimensions 'day' and those of the groups
+
+        Returns
+        -------
+        dataset : :class:`xarray.Dataset` object
+        """
+
+        days = np.array(self.days, dtype='datetime64[ns]')
+        data_vars = {}
+        coords = {}
+        for name, clock, how, by in self.reducers:
+            values = self.values[name]
+            if not clock:
+                values = values[-1:]
+            dims = (clock,) if clock else ()
+            empty = reductions[cumulatives[how][0] if how in cumulatives else how][1]
+            if by:
+                dim = by.split('__')[1]
+                groups = sorted(set(group for step in values for group in step))
+                # groups that do not exist at a step
+                data = np.array([[step.get(group, empty) for group in groups] for step in values], dtype=np.float64)
+                data = data.reshape(len(values), len(groups))
+                coords[dim] = groups
+                dims = dims + (dim,)
+            else:
+                data = np.array(values, dtype=np.float64)
+            if how in cumulatives:
+                data = cumulatives[how][1](data, axis=0)
+            if not clock:
+                data = data[0]
+            attrs = {'description': f'{how} over GU' + (f' by {by}' if by else '')}
+            data_vars[name] = (dims, data.astype(np.int64) if how.endswith('count_nonzero') else data, attrs)
+            if clock:
+                coords[clock] = days
+
+        return xr.Dataset(data_vars, coords=coords)
@@ -0,0 +1,348 @@
+"""Global sensitivity analysis of vmlab models with the Morris and Sobol methods
+
+Designs are generated lazily in groups of runs (a trajectory or a base sample), the runs are
+executed in chunks with vmlab.run_iter and reduced to scalar outputs in the workers, and the
+indices are accumulated group by group such that the memory does not depend on the number of runs.
+
+Example
+-------
+>>> design = vmlab.sensitivity.Sobol({
+...     'carbon_flow_coef__max_distance_to_fruit': (1, 10),
+...     'carbon_demand__DM_fruit_0': (10., 20.)
+... }, seed=0)
+>>> vmlab.sensitivity.analyze(setup, model, design, {'harvest__nb_fruit_harvested': 'sum'}, 1024)
+"""
+
+import abc
+import itertools
+import numpy as np
+import xarray as xr
+from scipy.stats import qmc
+from tqdm.auto import tqdm
+
+from .vmlab import run_iter, Executor
+
+
+class _Design(abc.ABC):
+    """Base of the designs, scales unit samples to the parameter ranges
+
+    Parameters
+    ----------
+    parameters : dict
+        Input variable name -> (low, high). Parameters with integer bounds (e.g. 'topology__seed')
+        take integer values in [low, high].
+    seed : int, optional
+        Seed of the random numbers of the design
+    """
+
+    # number of runs per group
+    group_size = 1
+
+    def __init__(self, parameters, seed=None):
+        assert len(parameters) > 0
+        self.parameters = list(parameters)
+        self.low = np.array([parameters[name][0] for name in self.parameters], dtype=np.float64)
+        self.high = np.array([parameters[name][1] for name in self.parameters], dtype=np.float64)
+        assert np.all(self.low < self.high), 'low must be lower than high'
+        self.is_integer = np.array([
+            all(isinstance(bound, (int, np.integer)) for bound in parameters[name]) for name in self.parameters
+        ])
+        self.seed = seed
+        self.outputs = None
+        # number of groups sampled and updated
+        self.nb_sampled = 0
+        self.nb_groups = 0
+
+    def _input_vars(self, unit):
+        """Input variables of a point of the unit hypercube"""
+        values = self.low + unit * (self.high - self.low)
+        # integers are equally probable
+        integers = np.minimum(np.floor(self.low + unit * (self.high - self.low + 1)), self.high)
+        return {
+            name: int(integers[i]) if self.is_integer[i] else float(values[i])
+            for i, name in enumerate(self.parameters)
+        }
+
+    def _outputs(self, results):
+        """Results of the runs of a group as an array (run, output)"""
+        if self.outputs is None:
+            self.outputs = list(results[0])
+            self._init_accumulators(len(self.outputs))
+        return np.array([[result[name] for name in self.outputs] for result in results], dtype=np.float64)
+
+    @abc.abstractmethod
+    def sample(self, nb_groups):
+        """Generate the input_vars of the runs of nb_groups groups lazily
+
+        Each call continues the design of the previous ones. Groups are numbered
+        in the order of generation.
+
+        Yields
+        ------
+        list
+            The input_vars of the runs of a group
+        """
+
+    @abc.abstractmethod
+    def update(self, group, results):
+        """Accumulate the indices with the results of the runs of a group
+
+        Parameters
+        ----------
+        group : int
+            Number of the group
+        results : list of dict
+            The reduced outputs (output name -> value) of the runs of the group in the order of sample
+        """
+
+    def discard(self, group):
+        """Forget a group that will not be updated, e.g. because runs failed"""
+        pass
+
+    @abc.abstractmethod
+    def indices(self):
+        """The indices accumulated so far
+
+        Returns
+        -------
+        dataset : :class:`xarray.Dataset` object
+            Indices with dimensions 'parameter' and 'output'
+        """
+
+    @abc.abstractmethod
+    def _init_accumulators(self, nb_outputs):
+        """Allocate the accumulators of the indices once the outputs are known"""
+
+    def _dataset(self, data_vars):
+        return xr.Dataset(
+            {name: (('parameter', 'output'), value, attrs) for name, (value, attrs) in data_vars.items()},
+            coords={'parameter': self.parameters, 'output': self.outputs or []},
+            attrs={'nb_groups': self.nb_groups}
+        )
+
+
+class Morris(_Design):
+    """Morris elementary effects screening
+
+    Each trajectory starts at a random point of a grid of nb_levels levels per parameter
+    and changes the parameters one at a time (in random order) by delta = nb_levels / (2 (nb_levels - 1)).
+    A trajectory is a group of (number of parameters + 1) runs. Elementary effects are
+    differences of outputs divided by delta, i.e. per unit of the normalized parameter range.
+
+    Parameters
+    ----------
+    parameters : dict
+        Input variable name -> (low, high)
+    nb_levels : int, optional
+        Number of levels of the grid, even
+    seed : int, optional
+        Seed of the random numbers of the design
+    """
+
+    def __init__(self, parameters, nb_levels=4, seed=None):
+        super().__init__(parameters, seed)
+        assert nb_levels >= 2 and nb_levels % 2 == 0
+        self.nb_levels = nb_levels
+        self.delta = nb_levels / (2 * (nb_levels - 1))
+        self.group_size = len(self.parameters) + 1
+        self._rng = np.random.default_rng(seed)
+        # (order, sign) of the trajectories sampled but not yet updated
+        self._directions = {}
+
+    def sample(self, nb_groups):
+        rng = self._rng
+        nb_parameters = len(self.parameters)
+        for _ in range(nb_groups):
+            unit = rng.integers(0, self.nb_levels, nb_parameters) / (self.nb_levels - 1)
+            order = rng.permutation(nb_parameters)
+            # up if possible, down otherwise or randomly if both are possible
+            up = unit + self.delta <= 1
+            down = unit - self.delta >= 0
+            sign = np.where(up & down, rng.choice([-1., 1.], nb_parameters), np.where(up, 1., -1.))
+            # the elementary effect of run k + 1 is that of parameter order[k]
+            self._directions[self.nb_sampled] = (order, sign[order])
+            runs = [self._input_vars(unit)]
+            for i in order:
+                unit = unit.copy()
+                unit[i] += sign[i] * self.delta
+                runs.append(self._input_vars(unit))
+            self.nb_sampled += 1
+            yield runs
+
+    def _init_accumulators(self, nb_outputs):
+        shape = (len(self.parameters), nb_outputs)
+        self._sum = np.zeros(shape)
+        self._sum_abs = np.zeros(shape)
+        self._sum_sq = np.zeros(shape)
+
+    def update(self, group, results):
+        order, sign = self._directions.pop(group)
+        y = self._outputs(results)
+        effects = np.diff(y, axis=0) / (sign[:, np.newaxis] * self.delta)
+        self._sum[order] += effects
+        self._sum_abs[order] += np.abs(effects)
+        self._sum_sq[order] += effects ** 2
+        self.nb_groups += 1
+
+    def discard(self, group):
+        self._directions.pop(group, None)
+
+    def indices(self):
+        n = self.nb_groups
+        if n == 0:
+            return self._dataset({})
+        mu = self._sum / n
+        sigma = np.sqrt(np.maximum(self._sum_sq - n * mu ** 2, 0) / (n - 1)) if n > 1 else np.full(mu.shape, np.nan)
+        return self._dataset({
+            'mu': (mu, {'description': 'Mean of the elementary effects'}),
+            'mu_star': (self._sum_abs / n, {'description': 'Mean of the absolute elementary effects'}),
+            'sigma': (sigma, {'description': 'Standard deviation of the elementary effects'})
+        })
+
+
+class Sobol(_Design):
+    """Sobol first order and total indices with the Saltelli (2010) scheme
+
+    Base samples are pairs of points A, B of a scrambled Sobol sequence. A base sample is a
+    group of (number of parameters + 2) runs: A, B and for each parameter A with the value
+    of the parameter of B. First order indices are estimated as in Saltelli et al. (2010),
+    total indices with the Jansen estimator. The number of base samples should be a power of 2.
+
+    Parameters
+    ----------
+    parameters : dict
+        Input variable name -> (low, high)
+    seed : int, optional
+        Seed of the scrambling of the Sobol sequence
+    """
+
+    # number of points drawn at once to keep the balance of the sequence
+    block_size = 64
+
+    def __init__(self, parameters, seed=None):
+        super().__init__(parameters, seed)
+        self.group_size = len(self.parameters) + 2
+        self._sampler = qmc.Sobol(2 * len(self.parameters), scramble=True, seed=seed)
+        self._points = np.empty((0, 2 * len(self.parameters)))
+
+    def sample(self, nb_groups):
+        nb_parameters = len(self.parameters)
+        for _ in range(nb_groups):
+            if not self._points.shape[0]:
+                self._points = self._sampler.random(self.block_size)
+            a, b = self._points[0, :nb_parameters], self._points[0, nb_parameters:]
+            self._points = self._points[1:]
+            runs = [self._input_vars(a), self._input_vars(b)]
+            for i in range(nb_parameters):
+                ab = a.copy()
+                ab[i] = b[i]
+                runs.append(self._input_vars(ab))
+            self.nb_sampled += 1
+            yield runs
+
+    def _init_accumulators(self, nb_outputs):
+        shape = (len(self.parameters), nb_outputs)
+        # running mean and sum of squared deviations of the outputs of A and B (Welford)
+        self._nb_y = 0
+        self._mean = np.zeros(nb_outputs)
+        self._m2 = np.zeros(nb_outputs)
+        self._sum_first = np.zeros(shape)
+        self._sum_total = np.zeros(shape)
+
+    def update(self, group, results):
+        y = self._outputs(results)
+        y_a, y_b, y_ab = y[0], y[1], y[2:]
+        for value in (y_a, y_b):
+            self._nb_y += 1
+            delta = value - self._mean
+            self._mean += delta / self._nb_y
+            self._m2 += delta * (value - self._mean)
+        self._sum_first += y_b * (y_ab - y_a)
+        self._sum_total += (y_a - y_ab) ** 2
+        self.nb_groups += 1
+
+    def indices(self):
+        n = self.nb_groups
+        if n == 0:
+            return self._dataset({})
+        variance = self._m2 / (self._nb_y - 1) if self._nb_y > 1 else np.full(self._m2.shape, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            first = self._sum_first / n / variance
+            total = 0.5 * self._sum_total / n / variance
+        return self._dataset({
+            'S1': (first, {'description': 'First order Sobol index'}),
+            'ST': (total, {'description': 'Total Sobol index'})
+        })
+
+
+def analyze(dataset, model, design, outputs, nb_groups, chunk_size=64, progress=True, nb_proc=None, executor=None, retries=0, errors='raise'):
+    """Run a design in batches and compute its sensitivity indices
+
+    The groups of runs are generated lazily and submitted chunk_size groups at a time.
+    Each run is reduced in its worker to the outputs (see vmlab.run_iter) and the indices
+    are updated as soon as all runs of a group completed. Groups with failed runs are
+    ignored if errors is 'skip'.
+
+    Parameters
+    ----------
+    dataset : :class:`xarray.Dataset` object
+        The dataset created with vmlab.create_setup, it must record the variables in outputs
+    model : :class:`xsimlab.Model` object
+        A vmlab model
+    design : :class:`Morris` or :class:`Sobol` object
+        The design, the indices of previous calls are accumulated
+    outputs : dict
+        Output variable -> name of a reduction method of xarray.DataArray (e.g. 'sum', 'mean', 'max')
+        or a function of the DataArray returning a scalar
+    nb_groups : int
+        Number of trajectories (Morris) or base samples (Sobol)
+    chunk_size : int, optional
+        Number of groups submitted at once
+    progress : bool, optional
+        If true displays a progress bar of the runs
+    nb_proc : int, optional
+        Number of workers if executor is None. Defaults to the number of CPU cores available
+    executor : :class:`vmlab.Executor` object, optional
+        Workers used for all chunks. If None a temporary pool of workers is created
+    retries : int, optional
+        Number of times a failed run is resubmitted
+    errors : str, optional
+        'raise' a vmlab.BatchError if runs failed or 'skip' their groups with a warning
+
+    Returns
+    -------
+    indices : :class:`xarray.Dataset` object
+        The indices with dimensions 'parameter' and 'output'
+    """
+
+    temporary = None
+    if executor is None:
+        executor = temporary = Executor(nb_proc)
+    start = design.nb_sampled
+    groups = design.sample(nb_groups)
+    size = design.group_size
+    try:
+        with tqdm(total=nb_groups * size, disable=not progress) as bar:
+            while True:
+                chunk = list(itertools.islice(groups, chunk_size))
+                if not chunk:
+                    break
+                results = {}
+                for id, result in run_iter(
+                    dataset, model, ('run', [input_vars for runs in chunk for input_vars in runs]), progress=False,
+                    executor=executor, retries=retries, errors=errors, reduce=outputs
+                ):
+                    results[id] = result
+                    bar.update(1)
+                for i in range(len(chunk)):
+                    ids = range(i * size, (i + 1) * size)
+                    if all(id in results for id in ids):
+                        design.update(start + i, [results[id] for id in ids])
+                    else:
+                        design.discard(start + i)
+                start += len(chunk)
+    finally:
+        if temporary is not None:
+            temporary.shutdown(wait=False)
+
+    return design.indices()
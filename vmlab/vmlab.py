@@ -1,4 +1,13 @@
 import io
+import os
+import threading
+import concurrent.futures
+import mmap
+import pickle
+import struct
+import tempfile
+import time
+from queue import Empty
 import warnings
 import multiprocessing as mp
 import xsimlab as xs
@@ -6,15 +15,23 @@ import xarray as xr
 from xsimlab.variable import VarIntent
 import pandas as pd
 import numpy as np
-import igraph as ig
 import openalea.plantgl.all as pgl
 from tqdm.auto import tqdm
 import toml
+import zarr
+from xsimlab.stores import DummyLock
 import pathlib
 import IPython
 import pgljupyter
 from importlib import resources
 
+from .monitoring import Profiler, MemoryMonitor
+from .checkpoint import Checkpointer, has_checkpoint
+from .branching import Brancher
+from .cache import ResultCache
+from .reducers import OutputReducer, parse_reducer
+from .delta import DeltaRecorder, parse_delta, decode_deltas
+
 pgl.pglParserVerbose(False)
 
 
@@ -81,6 +98,61 @@ def copy_model(model):
     return _model_from_parameters(_model_parameters(model))
 
 
+def _get_parent(df):
+    """Index (row position) of the parent of each GU in a tree DataFrame, -1 for the root
+    """
+    ids = pd.Index(df['id'].astype(np.int64))
+    assert ids.is_unique, 'ids must be unique'
+    has_parent = df['parent_id'].notna().to_numpy()
+    parent = np.full(len(df), -1, dtype=np.int32)
+    parent[has_parent] = ids.get_indexer(df['parent_id'].to_numpy()[has_parent].astype(np.int64))
+    assert np.all(parent[has_parent] >= 0), 'all parent_ids must be present in ids'
+    return parent
+
+
+def _check_parent(parent, is_apical=None):
+    """Test if a tree given as parent indices is valid and usable in vmlab
+    """
+    from vmlab.processes.topology import get_depth
+
+    # tree must not be empty
+    assert parent.shape[0] > 0
+    # only one tree/component
+    assert np.count_nonzero(parent < 0) == 1
+    # all vertices must be connected to the root i.e. there are no cycles
+    assert np.all(get_depth(parent) >= 0)
+    # all vertices may have at most one apical child
+    if is_apical is not None:
+        has_parent = parent >= 0
+        nb_apical_children = np.bincount(
+            parent[has_parent],
+            weights=np.nan_to_num(np.asarray(is_apical, dtype=np.float64)[has_parent]),
+            minlength=parent.shape[0]
+        )
+        assert np.all(nb_apical_children <= 1)
+
+
+def check_tree(df: pd.DataFrame):
+    """Test if a tree DataFrame's structure is valid and usable in vmlab:
+
+        - not empty
+        - ids are unique and all parent_ids are ids
+        - acyclic
+        - all vertices are connected
+        - at most one apical child per parent
+
+    Parameters
+    ----------
+    df : :class:`pandas.DataFrame` object
+        Required format is identical with what is specified for the
+        'tree' input in the vmlab.create_setup function.
+    """
+
+    assert 'id' in df.columns.to_list() and 'parent_id' in df.columns.to_list()
+
+    _check_parent(_get_parent(df), df['topology__is_apical'] if 'topology__is_apical' in df.columns else None)
+
+
 def check_graph(graph):
     """Test if an igraph graph's structure is valid and usable in vmlab:
 
@@ -94,25 +166,23 @@ def check_graph(graph):
     graph : :class:`igraph.Graph` object
     """
 
-    # tree must not be empty
-    assert len(graph.vs.indices) > 0
-    # tree must be directed and acyclic
-    assert graph.is_dag()
-    # all vertices must be connected (only one tree/component)
-    assert len(graph.components('weak').sizes()) == 1
-    # all vertices may have at most one apical child
+    assert graph.is_directed()
+    edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    # at most one parent per vertex
+    assert np.all(np.bincount(edges[:, 1], minlength=graph.vcount()) <= 1)
+    parent = np.full(graph.vcount(), -1, dtype=np.int64)
+    parent[edges[:, 1]] = edges[:, 0]
+    is_apical = None
     if 'topology__is_apical' in graph.vs.attribute_names():
-        for v in graph.vs:
-            successors = v.successors()
-            nb_apical_children = 0
-            for successor in successors:
-                nb_apical_children = nb_apical_children + successor['topology__is_apical']
-                assert nb_apical_children <= 1
+        is_apical = np.array(graph.vs.get_attribute_values('topology__is_apical'), dtype=np.float64)
+    _check_parent(parent, is_apical)
 
 
 def to_graph(df: pd.DataFrame):
     """Load and validate an igraph graph from a pandas DataFrame
 
+    Requires the optional igraph package.
+
     Parameters
     ----------
     df : :class:`pandas.DataFrame` object
@@ -123,8 +193,9 @@ def to_graph(df: pd.DataFrame):
     -------
     graph : :class:`igraph.Graph`
     """
+    import igraph as ig
 
-    assert 'id' in df.columns.to_list() and 'parent_id' in df.columns.to_list()
+    check_tree(df)
 
     edges = df[['parent_id', 'id']].dropna().astype(np.int64)
     vertices = df.drop('parent_id', axis=1) if len(df.columns.to_list()) > 2 else None
@@ -132,14 +203,14 @@ def to_graph(df: pd.DataFrame):
         vertices['id'].astype(np.int64, copy=False)
     graph = ig.Graph.DataFrame(edges, vertices=vertices)
 
-    check_graph(graph)
-
     return graph
 
 
 def to_dataframe(graph):
     """Load and validate an pandas DataFrame from an igraph graph
 
+    Vertex indices are used as ids.
+
     Parameters
     ----------
     graph : :class:`igraph.Graph`
@@ -149,35 +220,49 @@ def to_dataframe(graph):
     df : :class:`pandas.DataFrame` object
     """
 
-    edges = np.argwhere(np.array(graph.get_adjacency().data))
+    check_graph(graph)
+
+    edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    parent_id = np.full(graph.vcount(), np.nan)
+    parent_id[edges[:, 1]] = edges[:, 0]
     df = pd.DataFrame({
-        'id': np.append(0, edges[:, 1]),
-        'parent_id': np.append(np.nan, edges[:, 0])
-    }).join(graph.get_vertex_dataframe())
+        'id': np.arange(graph.vcount()),
+        'parent_id': parent_id
+    }).join(graph.get_vertex_dataframe().drop(columns=['id', 'parent_id'], errors='ignore'))
 
     return df
 
 
-def _get_inputs_from_graph(graph, model, cycle):
+def _get_inputs_from_tree(tree, model, cycle):
 
     all_vars_dict = model.all_vars_dict
     inputs = {}
 
-    # drop all vertices where attr cycle > cycle if attr cycle is provided
-    if 'topology__cycle' in graph.vs.attribute_names():
-        graph.delete_vertices(graph.vs.select(topology__cycle_gt=cycle))
-        check_graph(graph)
-    else:
-        graph.vs.set_attribute_values('topology__cycle', cycle)
+    # a list of trees is simulated as a forest: all GUs in one index, numbered tree by tree
+    trees = list(tree) if isinstance(tree, (list, tuple)) else [tree]
+    parents = []
+    for idx, tree in enumerate(trees):
+        check_tree(tree)
+        # drop all vertices where attr cycle > cycle if attr cycle is provided
+        if 'topology__cycle' in tree.columns:
+            tree = tree[~(tree['topology__cycle'] > cycle).to_numpy()]
+            check_tree(tree)
+        else:
+            tree = tree.assign(topology__cycle=cycle)
+        parent = _get_parent(tree)
+        offset = sum(p.shape[0] for p in parents)
+        parents.append(np.where(parent >= 0, parent + offset, -1).astype(np.int32))
+        trees[idx] = tree.assign(topology__tree=idx)
+    tree = pd.concat(trees, ignore_index=True)
 
-    inputs['topology__adjacency'] = np.array(graph.get_adjacency().data, dtype=np.float32)
+    inputs['topology__parent'] = np.concatenate(parents)
 
-    for attr in graph.vs.attribute_names():
+    for attr in tree.columns:
         if attr.find('__', 1, -1) > 0:
             prc_name, var_name = attr.split('__', maxsplit=1)
             if prc_name in all_vars_dict and var_name in all_vars_dict[prc_name]:
                 # not sure what the best way is to figure out the date type
-                inputs[attr] = np.array(graph.vs.get_attribute_values(attr)).astype('datetime64[ns]' if 'date' in var_name else np.float32)
+                inputs[attr] = tree[attr].to_numpy().astype('datetime64[ns]' if 'date' in var_name else np.float32)
 
     return inputs
 
@@ -217,13 +302,16 @@ def create_setup(
         all GUs of cycle > current_cycle will be automatically pruned
         from the initial tree. If they are not provided the cycle
         property of all initially present GUs will be set to 'current_cycle'
-    tree : :class:`pandas.DataFrame object, optional
+    tree : :class:`pandas.DataFrame object or list, optional
         A pandas DataFrame with at least the following columns:
         'id', 'parent_id' and 'topology__is_apical'
         Optionally any other input variable with a 'GU' dimension may be added.
         Column names follow the 'foo__bar' naming logic (see input_vars).
         If None it is expected that a path to a csv file is present in the
         setup_toml file.
+        If a list of DataFrames is given all trees are simulated at once in
+        one model (forest) sharing the environment. Outputs with a 'GU'
+        dimension are split per tree along a 'tree' dimension.
     input_vars : dict, optional
         Dictionary with values given for model inputs. Entries of the
         dictionary may look like:
@@ -236,7 +324,19 @@ def create_setup(
         Dictionary with model variable names to save as simulation output
         (time-dependent or time-independent). Entries of the dictionary look
         similar than for ``input_vars`` (see here above) except: 'value' may
-        be 'day' (daily output) or None (once at the end of the simulation)
+        be 'day' (daily output) or None (once at the end of the simulation).
+        Variables with dimension 'GU' may be reduced over the GUs while the model
+        runs such that only the reduced values are stored: 'value' is a tuple
+        (clock, reduction) or (clock, reduction, by) where reduction is 'sum', 'mean',
+        'max', 'min', 'count_nonzero' or one of the cumulative forms 'cumsum', 'cummax',
+        'cummin', 'cumcount_nonzero' and by is a variable with dimension 'GU'
+        (e.g. 'topology__cycle' or 'arch_dev_rep__nature') to reduce the GUs per value of by,
+        e.g. ``{'harvest__nb_fruit_harvested': ('day', 'sum', 'topology__cycle')}``.
+        Slowly changing variables with dimension 'GU' may be recorded as changes
+        of (GU, value) between days and a complete snapshot every keyframe_freq days:
+        'value' is (clock, 'delta') or (clock, 'delta', keyframe_freq), e.g.
+        ``{'topology__cycle': ('day', 'delta')}``. The outputs of vmlab.run are
+        reconstructed lazily (see vmlab.decode_deltas).
 
     Returns
     -------
@@ -287,14 +387,17 @@ def create_setup(
             else:
                 raise ValueError('No initial tree provided')
 
-    graph = to_graph(tree)
-    input_vars.update(_get_inputs_from_graph(graph, model, current_cycle))
+    tree_inputs = _get_inputs_from_tree(tree, model, current_cycle)
+    input_vars.update(tree_inputs)
+    nb_trees = len(tree) if isinstance(tree, (list, tuple)) else 1
     input_vars['topology__current_cycle'] = current_cycle
     # work-around for main_clock not available at initialization.
     # set the start date variable
     input_vars['topology__sim_start_date'] = start_date
 
     output_vars_ = {}
+    reducers = []
+    deltas = []
     if type(output_vars) == dict:
         for name, item in output_vars.items():
             if type(item) == dict:
@@ -303,6 +406,23 @@ def create_setup(
             else:
                 output_vars_[name] = item
         output_vars = output_vars_.copy()
+        # reduced and delta encoded variables are recorded by runtime hooks, simlab only keeps the last value
+        for name, item in list(output_vars.items()):
+            if isinstance(item, tuple) and len(item) > 1 and item[1] == 'delta':
+                assert nb_trees == 1, 'delta encoded outputs of forests are not supported'
+                deltas.append(parse_delta(name, item, list(clocks), model))
+                output_vars_[name] = None
+                # replaced by the encoded variables
+                del output_vars[name]
+            elif isinstance(item, tuple):
+                reducers.append(parse_reducer(name, item, list(clocks), model))
+                output_vars_[name] = None
+
+    if nb_trees > 1 and 'topology__tree' not in output_vars_:
+        # required to split outputs per tree
+        output_vars_['topology__tree'] = None
+        if type(output_vars) is dict:
+            output_vars['topology__tree'] = None
 
     for prc_name in model:
         prc = model[prc_name]
@@ -312,15 +432,14 @@ def create_setup(
         for var_name in xs.filter_variables(prc, var_type='variable', func=lambda var: not var.metadata['static']):
             if f'{prc_name}__{var_name}' not in output_vars_:
                 output_vars_[f'{prc_name}__{var_name}'] = output_vars if type(output_vars) is str else None  # str must be clock name
-        if graph is not None:
-            # make simlab happy by passing initial 'inout' values used to model cycles (needlessly)
-            shape = (len(graph.vs.indices),)
-            for var_name in xs.filter_variables(prc, var_type='variable', func=lambda var: var.metadata['intent'] == VarIntent.INOUT and 'GU' in list(sum(var.metadata['dims'], ()))):
-                if f'{prc_name}__{var_name}' not in input_vars:
-                    if 'date' in var_name:
-                        input_vars[f'{prc_name}__{var_name}'] = np.full(shape, np.datetime64('NaT'), dtype='datetime64[ns]')
-                    else:
-                        input_vars[f'{prc_name}__{var_name}'] = np.full(shape, np.nan, dtype=np.float32)
+        # make simlab happy by passing initial 'inout' values used to model cycles (needlessly)
+        shape = tree_inputs['topology__parent'].shape
+        for var_name in xs.filter_variables(prc, var_type='variable', func=lambda var: var.metadata['intent'] == VarIntent.INOUT and 'GU' in list(sum(var.metadata['dims'], ()))):
+            if f'{prc_name}__{var_name}' not in input_vars:
+                if 'date' in var_name:
+                    input_vars[f'{prc_name}__{var_name}'] = np.full(shape, np.datetime64('NaT'), dtype='datetime64[ns]')
+                else:
+                    input_vars[f'{prc_name}__{var_name}'] = np.full(shape, np.nan, dtype=np.float32)
 
     return xs.create_setup(
         model,
@@ -330,12 +449,48 @@ def create_setup(
         output_vars_,
     ).assign_attrs({
         # store as private attr so we can drop all outputs later that we just added to make zarr work with growing indices
-        '__vmlab_output_vars': list(output_vars.keys()) if output_vars is not None else []
+        '__vmlab_output_vars': list(output_vars.keys()) if output_vars is not None else [],
+        '__vmlab_nb_trees': nb_trees,
+        '__vmlab_reducers': reducers,
+        '__vmlab_deltas': deltas
     })
 
 
+def _split_trees(ds, nb_trees):
+    """Split the GUs of a forest into a 'tree' dimension, GUs and parents are renumbered per tree
+    """
+
+    tree = ds['topology__tree']
+    if 'day' in tree.dims:
+        tree = tree.isel(day=-1)
+    tree = tree.values
+    gu_vars = [name for name in ds.data_vars if 'GU' in ds[name].dims]
+
+    datasets = []
+    for idx in range(nb_trees):
+        gus = np.flatnonzero(tree == idx)
+        ds_tree = ds.isel(GU=gus).assign_coords(GU=np.arange(gus.shape[0]))
+        if 'topology__parent' in ds_tree:
+            # the last item maps the parent of roots (-1) to -1
+            local = np.full(tree.shape[0] + 1, -1, dtype=np.int64)
+            local[gus] = np.arange(gus.shape[0])
+            parent = ds_tree['topology__parent']
+            ds_tree['topology__parent'] = parent.copy(data=local[np.where(parent.values >= 0, parent.values, -1)])
+        for name in gu_vars:
+            ds_tree[name] = ds_tree[name].expand_dims('tree')
+        datasets.append(ds_tree)
+
+    return xr.concat(
+        datasets, dim='tree', data_vars='minimal', coords='minimal', compat='override'
+    ).assign_coords(tree=np.arange(nb_trees))
+
+
 def _cleaup_dataset(ds):
 
+    # split forest outputs per tree
+    if ds.attrs.get('__vmlab_nb_trees', 1) > 1 and 'topology__tree' in ds:
+        ds = _split_trees(ds, ds.attrs['__vmlab_nb_trees'])
+
     # keep only those that were explicitly defined as output
     if '__vmlab_output_vars' in ds.attrs:
         ds = ds.drop_vars(set(ds.keys()).difference(ds.attrs['__vmlab_output_vars']))
@@ -362,92 +517,708 @@ def _cleaup_dataset(ds):
     return ds
 
 
-def _fn_parallel(id, ds, geometry, store):
+def _add_monitors(ds, monitors):
+    """Merge the datasets of monitoring hooks into the output dataset of a run and keep them as output
 
-    if store is not None:
-        store = f'{store}__{id}.zarr'
+    Variables of the output are replaced by monitored variables of the same name (e.g. reduced outputs).
+    """
+    for monitor in monitors:
+        monitored = monitor.to_dataset()
+        ds = ds.drop_vars([name for name in monitored.data_vars if name in ds])
+        ds = xr.merge([ds, monitored], join='left', combine_attrs='override')
+        if '__vmlab_output_vars' in ds.attrs:
+            ds.attrs['__vmlab_output_vars'] = list(ds.attrs['__vmlab_output_vars']) + list(monitored.data_vars)
+    return ds
+
+
+def _create_monitors(ds, profile, memory):
+    monitors = []
+    if len(ds.attrs.get('__vmlab_reducers', [])):
+        monitors.append(OutputReducer(ds.attrs['__vmlab_reducers']))
+    if len(ds.attrs.get('__vmlab_deltas', [])):
+        monitors.append(DeltaRecorder(ds.attrs['__vmlab_deltas']))
+    if profile:
+        monitors.append(Profiler())
+    if memory:
+        monitors.append(MemoryMonitor(trace=memory != 'state'))
+    return monitors
+
+
+def _share_dataset(ds):
+    """Write a dataset to a temporary file from which workers map its arrays without copying
+
+    The arrays are written as pickle (protocol 5) out-of-band buffers followed by the
+    pickled dataset, their offsets and lengths and the length of the latter.
+
+    Returns
+    -------
+    str
+        Path of the file, to be removed by the caller
+    """
+    buffers = []
+    header = pickle.dumps(ds, protocol=5, buffer_callback=buffers.append)
+    fd, path = tempfile.mkstemp(suffix='.vmlab')
+    offsets = []
+    lengths = []
+    with os.fdopen(fd, 'wb') as f:
+        for buffer in buffers:
+            raw = buffer.raw()
+            # align arrays to 64 bytes
+            f.write(b'\0' * (-f.tell() % 64))
+            offsets.append(f.tell())
+            lengths.append(raw.nbytes)
+            f.write(raw)
+        index = pickle.dumps((header, offsets, lengths))
+        f.write(index)
+        f.write(struct.pack('<Q', len(index)))
+    return path
+
+
+def _load_shared_dataset(path):
+    """Load a dataset written by _share_dataset with copy-on-write memory mapped arrays"""
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    size = struct.unpack('<Q', mm[-8:])[0]
+    header, offsets, lengths = pickle.loads(mm[-8 - size:-8])
+    view = memoryview(mm)
+    return pickle.loads(header, buffers=[view[offset:offset + length] for offset, length in zip(offsets, lengths)])
+
+
+def _get_setup(setup):
+    """Setup dataset of a worker, loaded only once per batch run
+
+    setup is the path of a shared dataset or the dataset itself (external executors)
+    """
+    if isinstance(setup, xr.Dataset):
+        return setup
+    worker = _get_worker()
+    if setup not in worker.setups:
+        worker.setups = {setup: _load_shared_dataset(setup)}
+    return worker.setups[setup]
+
+
+def _default_fill_value(dtype):
+    """Fill value of runs of a batch padded to the extent of the others"""
+    if dtype.kind == 'f':
+        return np.nan
+    # 0 would be a valid index
+    if dtype.kind == 'i':
+        return -1
+    return 0
+
+
+def _write_variable(group, name, variable, dims, region, shape, chunks, lock, shared=False):
+    """Write a variable into region of a zarr array that is created or grown to shape if needed
+
+    Variables are CF-encoded as xarray would do, datetimes as nanoseconds since 1970-01-01
+    so that all writers share the same encoding. Signed integers are padded with -1 (e.g. GU
+    indices like topology__parent) unless the variable defines a fill value. Shared variables
+    (e.g. coordinates) are written by several runs into the same chunks and hold the lock.
+    """
+    if variable.dtype.kind == 'M':
+        variable = variable.copy(deep=False)
+        variable.encoding = {
+            'units': 'nanoseconds since 1970-01-01', 'dtype': np.dtype('int64'), '_FillValue': np.iinfo(np.int64).min
+        }
+    encoded = xr.conventions.encode_cf_variable(variable, name=name)
+    attrs = dict(encoded.attrs)
+    values = np.asarray(encoded.values)
+    fill_value = attrs.pop('_FillValue', _default_fill_value(values.dtype))
+    with lock:
+        if name not in group:
+            array = group.create_dataset(name, shape=shape, chunks=chunks, dtype=values.dtype, fill_value=fill_value)
+            array.attrs.update(attrs)
+            array.attrs['_ARRAY_DIMENSIONS'] = list(dims)
+        else:
+            array = group[name]
+            new_shape = tuple(np.maximum(array.shape, shape))
+            if new_shape != array.shape:
+                array.resize(new_shape)
+        if shared:
+            array[region] = values
+    if not shared:
+        array[region] = values
+
+
+def _write_region(path, ds, batch_dim, batch_size, index, lock):
+    """Write the output of one run of a batch into the zarr store at path at index of the batch dimension
+
+    Data variables get the batch dimension, coordinates are shared by all runs. Dimensions
+    are grown to the largest extent of all runs and smaller outputs are padded with fill values.
+    """
+    group = zarr.open_group(path, mode='a')
+    for name, variable in ds.variables.items():
+        extent = tuple(slice(0, length) for length in variable.shape)
+        chunks = tuple(max(length, 1) for length in variable.shape)
+        if name in ds.coords:
+            _write_variable(group, name, variable, variable.dims, extent, variable.shape, chunks, lock, shared=True)
+        else:
+            _write_variable(
+                group, name, variable, (batch_dim,) + variable.dims, (index,) + extent,
+                (batch_size,) + variable.shape, (1,) + chunks, lock
+            )
 
-    @xs.runtime_hook(stage='finalize')
-    def finalize(model, context, state):
-        _fn_parallel.queue.put((id, 1))
+
+# state of a batch worker, a process or a thread
+_worker = threading.local()
+
+
+def _limit_blas_threads(nb_threads):
+    """Limit the threads of BLAS/OpenMP libraries to avoid oversubscription by several workers
+
+    The environment only affects libraries loaded later, threadpoolctl (if installed)
+    also those already loaded.
+    """
+    for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS'):
+        os.environ[name] = str(nb_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(nb_threads)
+
+
+def _f_init(queue, steps, jobs, nb_workers, lock, blas_threads=0):
+    if blas_threads:
+        _limit_blas_threads(blas_threads)
+    _worker.queue = queue
+    _worker.lock = lock
+    _worker.steps = steps
+    _worker.jobs = jobs
+    with nb_workers.get_lock():
+        # workers replacing crashed ones may share a slot
+        _worker.slot = nb_workers.value % len(steps)
+        nb_workers.value += 1
+    _worker.models = {}
+    _worker.setups = {}
+
+
+def _get_worker():
+    """State of the current worker, initialized without progress and scenes for external executors"""
+    if not hasattr(_worker, 'models'):
+        _worker.queue = None
+        _worker.lock = threading.Lock()
+        _worker.steps = None
+        _worker.jobs = None
+        _worker.slot = 0
+        _worker.models = {}
+        _worker.setups = {}
+    return _worker
+
+
+def _get_model(model_param):
+    """Model of a worker, built only once per worker and model"""
+    worker = _get_worker()
+    key = tuple(model_param.items())
+    if key not in worker.models:
+        worker.models[key] = _model_from_parameters(model_param)
+    return worker.models[key]
+
+
+def _create_checkpointer(ds, checkpoint, id=None):
+    """Checkpointer of a run, in batch mode (id is not None) of the run's subdirectory
+
+    A run of a batch without checkpoint to resume from starts from the beginning.
+    """
+    if checkpoint is None:
+        return None
+    path, freq, resume_from = checkpoint
+    if path is None and resume_from is None:
+        return None
+    if id is not None:
+        path = None if path is None else os.path.join(path, str(id))
+        resume_from = None if resume_from is None else os.path.join(resume_from, str(id))
+        if resume_from is not None and not has_checkpoint(resume_from):
+            resume_from = None
+    return Checkpointer(ds, path, freq, resume_from)
+
+
+def _reduce_output(ds, reduce):
+    """Reduce the variables of an output to floats
+
+    Parameters
+    ----------
+    ds : :class:`xarray.Dataset` object
+        The output of a run
+    reduce : dict
+        Variable name -> name of a reduction method of xarray.DataArray (e.g. 'sum', 'mean', 'max')
+        or a function of the DataArray that returns a scalar
+
+    Returns
+    -------
+    dict
+        Variable name -> value
+    """
+    return {
+        name: float(how(ds[name]) if callable(how) else getattr(ds[name], how)())
+        for name, how in reduce.items()
+    }
+
+
+def _fn_parallel(id, model_param, setup, input_vars, geometry, store, profile, memory, checkpoint, reduce=None):
+
+    worker = _get_worker()
 
     @xs.runtime_hook(stage='run_step')
     def run_step(model, context, state):
-        _fn_parallel.queue.put((id, 0))
-        if geometry:
+        # each worker is the only writer of its slot, the parent polls the sum
+        if worker.steps is not None:
+            worker.steps[worker.slot] += 1
+        if geometry and worker.queue is not None:
             scene = state[('geometry', 'scene')]
             if scene is not None:
-                _fn_parallel.queue.put((id, pgl.tobinarystring(scene, False)))
-
-    hooks = [finalize, run_step]
-    try:
-        out = ds.xsimlab.run(_fn_parallel.model, decoding={'mask_and_scale': False}, hooks=hooks, store=store)
-    except Exception:
-        import traceback
-        import logging
-        logging.error(traceback.format_exc())
-        _fn_parallel.queue.put((id, 1))
-        return ds
+                worker.queue.put((id, pgl.tobinarystring(scene, False)))
+
+    model = _get_model(model_param)
+    ds = _get_setup(setup).xsimlab.update_vars(model, input_vars=input_vars)
+    monitors = _create_monitors(ds, profile, memory)
+    hooks = [run_step] + monitors
+    checkpointer = _create_checkpointer(ds, checkpoint, id)
+    if checkpointer is not None:
+        hooks.append(checkpointer)
+    out = ds.xsimlab.run(model, decoding={'mask_and_scale': False}, hooks=hooks)
+    out = _add_monitors(out, monitors)
+    if checkpointer is not None:
+        out = checkpointer.merge_outputs(out, model)
+    if reduce is not None:
+        return _reduce_output(decode_deltas(_cleaup_dataset(out)), reduce)
+    if store is not None:
+        path, batch_dim, batch_size = store
+        _write_region(path, _cleaup_dataset(out), batch_dim, batch_size, id, worker.lock)
+        return None
 
     return out
 
 
-def _f_init(queue, model_param):
-    _fn_parallel.queue = queue
-    _fn_parallel.model = _model_from_parameters(model_param)
+def _fn_chunk(chunk):
+    """Run a chunk of jobs one after the other
 
+    Returns
+    -------
+    list
+        (index, wall-clock time [s], output, exception or None) of each job
+    """
+    worker = _get_worker()
+    results = []
+    for job in chunk:
+        # tells the parent which job was running if the worker process crashes
+        if worker.jobs is not None:
+            worker.jobs[worker.slot] = job[0]
+        start = time.perf_counter()
+        try:
+            out = _fn_parallel(*job)
+            error = None
+        except Exception as exception:
+            import traceback
+            import logging
+            logging.error(traceback.format_exc())
+            out = None
+            error = exception
+        results.append((job[0], time.perf_counter() - start, out, error))
+    if worker.jobs is not None:
+        worker.jobs[worker.slot] = -1
+    return results
+
+
+class BatchError(Exception):
+    """Raised if runs of a batch failed after all retries
+
+    Attributes
+    ----------
+    failures : dict
+        Index of each failed run -> exception of its last attempt
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        details = '\n'.join(f'  {id}: {type(error).__name__}: {error}' for id, error in sorted(failures.items()))
+        super().__init__(f'{len(failures)} run(s) of the batch failed:\n{details}')
 
-def _run_parallel(ds, model, store, batch, sw, scenes, positions, progress, nb_proc):
+
+class Executor():
+    """Workers of batch runs reused across calls of vmlab.run
+
+    The workers are started on first use and keep imported modules and
+    built models alive until shutdown is called. May be used as a context manager.
+
+    Parameters
+    ----------
+    nb_proc : int, optional
+        Number of workers. Defaults to the number of CPU cores available
+    backend : str or :class:`concurrent.futures.Executor` object, optional
+        'process' (default) for a pool of processes, 'thread' for a pool of threads or
+        any object implementing the concurrent.futures.Executor interface (e.g. the executor
+        of a dask distributed client). External executors are not shut down by vmlab, report
+        progress per completed run only, receive the setup with each run and do not
+        synchronize the creation of arrays in a batch store across processes.
+    blas_threads : int, optional
+        Number of BLAS/OpenMP threads of each worker process. Defaults to
+        maximum(1, number of CPU cores available // nb_proc), 0 leaves them unchanged.
+
+    Notes
+    -----
+    Runs of a batch are dispatched longest first according to their estimated cost:
+    the number of GUs times the number of steps plus the number of geometry
+    interpretations weighted by interpretation_cost. Wall-clock times of runs
+    already executed by the executor calibrate the estimates and replace them
+    for identical input_vars. Short runs are grouped in chunks to reduce the
+    dispatch overhead.
+
+    Examples
+    --------
+    >>> with vmlab.Executor(4) as executor:
+    ...     for batch in batches:
+    ...         vmlab.run(setup, model, batch=batch, executor=executor)
+    """
+
+    # interval [s] in which the progress of a batch run is polled
+    poll_interval = 0.1
+    # cost of a geometry interpretation relative to a step
+    interpretation_cost = 10.
+    # number of chunks per worker a batch is split into at least
+    chunks_per_worker = 4
+
+    def __init__(self, nb_proc=None, backend='process', blas_threads=None):
+        assert not isinstance(backend, str) or backend in ('process', 'thread'), 'unknown backend'
+        self.nb_proc = nb_proc or mp.cpu_count()
+        self.backend = backend
+        self.blas_threads = max(1, mp.cpu_count() // self.nb_proc) if blas_threads is None else blas_threads
+        # input_vars key -> wall-clock time [s] and estimated cost of runs already executed
+        self.timings = {}
+        self._queue = None
+        self._steps = None
+        self._jobs = None
+        self._lock = None
+        self._pool = None
+
+    @property
+    def is_local(self):
+        """True if the workers are processes or threads managed by the executor"""
+        return self.backend in ('process', 'thread')
+
+    def _create_pool(self):
+        # index of the job run by each worker, -1 if idle. Not shared with the workers of a
+        # replaced pool, they may still finish their job
+        self._jobs = mp.RawArray('q', [-1] * self.nb_proc)
+        initargs = [self._queue, self._steps, self._jobs, mp.Value('i', 0), self._lock]
+        if self.backend == 'process':
+            initargs.append(self.blas_threads)
+            return concurrent.futures.ProcessPoolExecutor(self.nb_proc, initializer=_f_init, initargs=initargs)
+        # BLAS limits are per process, hence not set for threads
+        return concurrent.futures.ThreadPoolExecutor(self.nb_proc, initializer=_f_init, initargs=initargs)
+
+    def _start(self):
+        if self._pool is None:
+            if self.is_local:
+                # scenes
+                self._queue = mp.Queue()
+                # number of steps run by each worker
+                self._steps = mp.RawArray('q', self.nb_proc)
+                # creating and resizing arrays of a batch store
+                self._lock = mp.Lock()
+                self._pool = self._create_pool()
+            else:
+                self._pool = self.backend
+        elif self._queue is not None:
+            # drop messages of interrupted runs
+            while not self._queue.empty():
+                self._queue.get_nowait()
+        return self._pool
+
+    def _restart(self):
+        """Replace a pool whose worker processes crashed"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = self._create_pool()
+
+    def shutdown(self, wait=True):
+        """Stop the workers
+
+        Parameters
+        ----------
+        wait : bool, optional
+            If true wait for pending runs, otherwise cancel them
+        """
+        if self._pool is None:
+            return
+        if self.is_local:
+            self._pool.shutdown(wait=wait, cancel_futures=not wait)
+            self._queue.close()
+        self._pool = self._queue = self._steps = self._jobs = self._lock = None
+
+    def _estimate(self, ds, batch_runs):
+        """Estimated wall-clock time (or cost if there are no timings) of each run of a batch"""
+        nb_steps = ds.day.values.shape[0] - 1
+        keys = [_job_key(input_vars) for input_vars in batch_runs]
+        costs = np.array([_estimate_cost(ds, input_vars, nb_steps, self.interpretation_cost) for input_vars in batch_runs])
+        if not self.timings:
+            return keys, costs, costs
+        # seconds per cost unit of the runs executed so far
+        rate = np.median([seconds / max(cost, 1.) for seconds, cost in self.timings.values()])
+        estimates = np.array([
+            self.timings[key][0] if key in self.timings else cost * rate for key, cost in zip(keys, costs)
+        ])
+        return keys, costs, estimates
+
+    def _running_jobs(self):
+        """Indices of the jobs the workers are running (None for external executors)"""
+        return None if self._jobs is None else set(job for job in self._jobs if job >= 0)
+
+    def _steps_done(self):
+        """Number of steps run by all workers since they were started (None for external executors)"""
+        return None if self._steps is None else sum(self._steps)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.shutdown(wait=typ is None)
+
+
+def _job_key(input_vars):
+    """A key identifying the input_vars of a run"""
+    return repr(sorted((name, np.asarray(value).tolist()) for name, value in input_vars.items()))
+
+
+def _estimate_cost(ds, input_vars, nb_steps, interpretation_cost):
+    """Cost of a run: number of GUs times the number of steps and weighted geometry interpretations"""
+    if 'topology__parent' in input_vars:
+        nb_gu = np.size(input_vars['topology__parent'])
+    else:
+        nb_gu = ds.dims.get('GU', 1)
+    nb_interpretations = 0
+    if 'geometry__interpretation_freq' in ds:
+        freq = input_vars.get('geometry__interpretation_freq', ds['geometry__interpretation_freq'].values)
+        steps = input_vars.get('geometry__interpretation_steps', ds['geometry__interpretation_steps'].values)
+        if not np.isnan(steps):
+            nb_interpretations = steps
+        elif freq > 0:
+            nb_interpretations = nb_steps / freq
+        elif freq == -1:
+            nb_interpretations = 2
+    return float(nb_gu * (nb_steps + interpretation_cost * nb_interpretations))
+
+
+def _get_chunks(estimates, nb_workers, chunks_per_worker):
+    """Group the runs longest first in chunks of about equal estimates, long runs stay alone"""
+    order = np.argsort(-estimates, kind='stable')
+    target = estimates.sum() / max(nb_workers * chunks_per_worker, 1)
+    chunks = []
+    chunk = []
+    total = 0.
+    for id in order.tolist():
+        chunk.append(id)
+        total += estimates[id]
+        if total >= target:
+            chunks.append(chunk)
+            chunk = []
+            total = 0.
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _batch_coordinate(batch):
+    """The batch dimension, an index with the batch values if there is only one variable in each batch"""
+    batch_dim, batch_runs = batch
+    if len(batch_runs) and all(x.keys() == batch_runs[0].keys() and len(x.keys()) == 1 for x in batch_runs):
+        return xr.IndexVariable(batch_dim, [x[list(batch_runs[0].keys())[0]] for x in batch_runs])
+    return batch_dim
+
+
+def _iter_parallel(ds, model, store, batch, sw, scenes, positions, progress, executor, profile, memory, retries, checkpoint=None, reduce=None):
+    """Run the jobs of a batch in the workers of executor and yield (index, output) as they complete
+
+    Jobs are submitted longest first in chunks (see Executor). A failed job is resubmitted
+    up to retries times. If a job crashed its worker process the pool is replaced and the
+    jobs the workers were running are accounted an attempt, the other jobs of the chunks that
+    failed with the pool are resubmitted without. If no job was running (or the executor is
+    external) all jobs of these chunks are accounted an attempt.
+    If store is a path all outputs are written into one zarr store with a batch dimension by
+    the workers and the yielded outputs are None. If reduce is given the workers reduce each
+    output to a dict of floats (see _reduce_output) which is yielded instead.
+
+    Raises
+    ------
+    BatchError
+        After all other jobs completed if jobs failed after all retries
+    """
     geometry = sw is not None
     batch_dim, batch_runs = batch
-    jobs = [(i, ds.xsimlab.update_vars(model, input_vars=input_vars), geometry, store) for i, input_vars in enumerate(batch_runs)]
-
-    queue = mp.Manager().Queue()
-    nb_workers = min(len(jobs), nb_proc or mp.cpu_count())
-    pool = mp.Pool(nb_workers, _f_init, [queue, _model_parameters(model)])
-
-    results = pool.starmap_async(_fn_parallel, jobs, error_callback=lambda err: print(err))
-    pool.close()
-
-    done = 0
-    nb_steps = len(jobs) * ds.day.values.shape[0] - len(jobs)
-
-    if progress:
-        with tqdm(total=nb_steps, bar_format='{bar} {percentage:3.0f}%') as bar:
-            while done < len(jobs):
-                id, got = queue.get()
-                if got == 0:
-                    bar.update()
-                elif got == 1:
-                    done += 1
-                elif geometry:
+    model_param = _model_parameters(model)
+    if store is not None:
+        group = zarr.open_group(store, mode='w')
+        dim = _batch_coordinate(batch)
+        if type(dim) is not str:
+            _write_variable(group, batch_dim, dim, dim.dims, slice(None), dim.shape, dim.shape, DummyLock())
+        # runs that did not complete are padded with fill values, their status tells them apart
+        status = xr.Variable((batch_dim,), np.full(len(batch_runs), 'pending', dtype='<U9'))
+        _write_variable(group, 'batch__status', status, status.dims, slice(None), status.shape, status.shape, DummyLock())
+        status = group['batch__status']
+        store = (store, batch_dim, len(batch_runs))
+
+    executor._start()
+    # the setup is shared once through a file, jobs only carry their input_vars
+    setup_path = _share_dataset(ds) if executor.is_local else None
+    setup = ds if setup_path is None else setup_path
+    jobs = [
+        (i, model_param, setup, input_vars, geometry, store, profile, memory, checkpoint, reduce)
+        for i, input_vars in enumerate(batch_runs)
+    ]
+
+    steps_done = executor._steps_done()
+    nb_steps_job = ds.day.values.shape[0] - 1
+    nb_steps = len(jobs) * nb_steps_job
+    nb_done = 0
+    attempts = [0] * len(jobs)
+    failures = {}
+    pending = {}
+    # jobs that were running when each broken pool crashed
+    crashed = {}
+    keys, costs, estimates = executor._estimate(ds, batch_runs)
+
+    def submit(chunk):
+        pending[executor._pool.submit(_fn_chunk, [jobs[id] for id in chunk])] = (executor._pool, chunk)
+
+    def retry(id, error):
+        if attempts[id] <= retries:
+            submit([id])
+        else:
+            failures[id] = error
+            if store is not None:
+                status[id] = 'failed'
+
+    try:
+        for chunk in _get_chunks(estimates, executor.nb_proc, executor.chunks_per_worker):
+            submit(chunk)
+        with tqdm(total=nb_steps, bar_format='{bar} {percentage:3.0f}%', disable=not progress) as bar:
+            while pending:
+                while geometry and executor._queue is not None:
+                    try:
+                        id, got = executor._queue.get_nowait()
+                    except Empty:
+                        break
                     scenes[id] = pgl.frombinarystring(got)
                     sw.set_scenes(scenes, scales=1/100, positions=positions)
-            bar.close()
-    else:
-        while done < len(jobs):
-            id, got = queue.get()
-            if got == 0:
+                if steps_done is None:
+                    bar.update(nb_done * nb_steps_job - bar.n)
+                else:
+                    bar.update(executor._steps_done() - steps_done - bar.n)
+                done, _ = concurrent.futures.wait(
+                    pending, timeout=executor.poll_interval, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    pool, chunk = pending.pop(future)
+                    try:
+                        results = future.result()
+                    except concurrent.futures.BrokenExecutor as error:
+                        # all futures of a broken pool fail, the pool is replaced at the first one
+                        if executor._pool is pool:
+                            crashed[pool] = executor._running_jobs()
+                            executor._restart()
+                        for id in chunk:
+                            attempts[id] += not crashed[pool] or id in crashed[pool]
+                            retry(id, error)
+                        continue
+                    for id, seconds, out, error in results:
+                        if error is not None:
+                            attempts[id] += 1
+                            retry(id, error)
+                            continue
+                        executor.timings[keys[id]] = (seconds, costs[id])
+                        nb_done += 1
+                        if store is not None:
+                            status[id] = 'completed'
+                        yield id, out if out is None or reduce is not None else _cleaup_dataset(out)
+    finally:
+        for future in pending:
+            future.cancel()
+        if setup_path is not None:
+            try:
+                os.remove(setup_path)
+            except OSError:
+                # still mapped by the workers (Windows)
                 pass
-            elif got == 1:
-                done += 1
-            elif geometry:
-                scenes[id] = pgl.frombinarystring(got)
-                sw.set_scenes(scenes, scales=1/100, positions=positions)
 
-    out = [_cleaup_dataset(ds) for ds in results.get()]
-    pool.terminate()
+    if failures:
+        raise BatchError(failures)
+
+
+def _run_parallel(ds, model, store, batch, sw, scenes, positions, progress, executor, profile, memory, retries, errors, checkpoint, cache=None):
+    batch_dim, batch_runs = batch
+    out = {}
+    # runs to execute, without cached and duplicated runs if there is a cache
+    todo = list(range(len(batch_runs)))
+    duplicates = {}
+    if cache is not None:
+        keys = [cache.key(ds, model, input_vars) for input_vars in batch_runs]
+        first = {}
+        todo = []
+        for id, key in enumerate(keys):
+            if key in first:
+                duplicates[id] = first[key]
+                continue
+            first[key] = id
+            cached = cache.get(key)
+            if cached is None:
+                todo.append(id)
+            else:
+                out[id] = cached
+        if len(todo) < len(batch_runs):
+            scenes = [None] * len(todo)
+            positions = [positions[id] for id in todo] if positions else positions
+
+    failures = {}
+    try:
+        if todo:
+            for i, result in _iter_parallel(
+                ds, model, store, (batch_dim, [batch_runs[id] for id in todo]), sw, scenes, positions, progress,
+                executor, profile, memory, retries, checkpoint
+            ):
+                out[todo[i]] = result
+                if cache is not None:
+                    cache.put(keys[todo[i]], result)
+    except BatchError as error:
+        failures = {todo[i]: exception for i, exception in error.failures.items()}
+    for id, original in duplicates.items():
+        if original in out:
+            out[id] = out[original]
+        elif original in failures:
+            failures[id] = failures[original]
+    if failures:
+        if errors == 'raise':
+            raise BatchError(failures)
+        warnings.warn(str(BatchError(failures)))
+
+    if store is not None:
+        zarr.consolidate_metadata(store)
+        return decode_deltas(xr.open_zarr(store, consolidated=True, mask_and_scale=False))
 
+    # encoded variables of different runs differ in length
+    return _concat_runs({id: decode_deltas(ds) for id, ds in out.items()}, batch)
+
+
+def _concat_runs(out, batch):
+    """Concatenate the outputs (index -> dataset) of the runs of a batch along the batch dimension"""
+    batch_dim, batch_runs = batch
     # if there is only one variable in the batch we set it as index with coords in concat
-    if len(batch_runs) and all(x.keys() == batch_runs[0].keys() and len(x.keys()) == 1 for x in batch_runs):
-        dim = xr.IndexVariable(batch_dim, [x[list(batch_runs[0].keys())[0]] for x in batch_runs])
+    # otherwise the index of the runs are the coords such that failed runs are identifiable
+    ids = sorted(out)
+    dim = _batch_coordinate(batch)
+    if type(dim) is str:
+        if len(ids) < len(batch_runs):
+            dim = xr.IndexVariable(batch_dim, ids)
     else:
-        dim = batch_dim
-
-    return xr.concat(out, dim=dim)
+        dim = dim[ids]
+    # runs are padded to the extent of the others, integers with -1 instead of NaN keep their dtype
+    fill_value = {
+        name: _default_fill_value(variable.dtype)
+        for ds in out.values() for name, variable in ds.data_vars.items() if variable.dtype.kind == 'i'
+    }
+    return xr.concat([out[id] for id in ids], dim=dim, fill_value=fill_value)
 
 
-def run(dataset, model, progress=True, geometry=False, batch=None, store=None, hooks=[], nb_proc=None, verbosity=0):
+def run(dataset, model, progress=True, geometry=False, batch=None, store=None, hooks=[], nb_proc=None, verbosity=0, profile=False, memory=False, executor=None, retries=0, errors='raise',
+        checkpoint=None, checkpoint_freq=30, resume_from=None, cache=None):
     """Run a vmlab model
 
     Wraps the xarray-simlab (v0.5.0) run function
@@ -468,7 +1239,10 @@ def run(dataset, model, progress=True, geometry=False, batch=None, store=None, h
     batch : tuple, optional
         A tuple of length 2 with a name and an array of dicts (input_vars)
     store : str, optional
-        A file path. In batch mode each batch's path will be extended with its index
+        A file path of a zarr store (overwritten). In batch mode the workers write all outputs
+        into this one store along the batch dimension, dimensions of different lengths are padded
+        with fill values, and a lazily opened (dask) Dataset is returned. The variable
+        'batch__status' tells if a run is 'completed', 'failed' or 'pending' (not run).
     hooks : list, optional
         One or more xarray-simlab runtime hooks
     nb_proc : int, optional
@@ -476,6 +1250,44 @@ def run(dataset, model, progress=True, geometry=False, batch=None, store=None, h
         Defaults to minimum(number of CPU cores available, number of batches)
     verbosity : int, optional
         0 = no vmlab warnings, 1 = all warnings
+    profile : bool, optional
+        If true the wall-clock time [s] of each process in each stage is added to the output
+        as 'profile__initialize', 'profile__finalize' (process) and 'profile__run_step',
+        'profile__finalize_step' (process, day) together with the number of GUs 'profile__nb_gu' (day).
+        In batch mode each job is profiled separately.
+    memory : bool or str, optional
+        If true the memory [B] allocated by each variable 'memory__variable' (variable, day) and
+        process 'memory__process' (process, day) and the peak resident set size 'memory__peak_rss' (day)
+        are added to the output. Allocations during run_step are attributed to the processes with
+        tracemalloc as 'memory__run_step_peak' and 'memory__run_step_retained' (process, day) unless
+        memory is 'state'. In batch mode each job is monitored separately in its worker.
+    executor : :class:`vmlab.Executor` object, optional
+        Workers used in batch mode. They are kept alive after the run and nb_proc is ignored.
+        If None a temporary pool of workers is created for this run.
+    retries : int, optional
+        Number of times a failed run of a batch is resubmitted. If a run crashes its worker
+        process the runs that were running in the other workers are accounted an attempt as well.
+    errors : str, optional
+        What to do if runs of a batch failed after all retries: 'raise' a vmlab.BatchError
+        once all other runs completed or 'skip' them with a warning. Skipped runs are missing
+        in the output and the index of the runs is used as batch coordinate.
+    checkpoint : str, optional
+        A directory to which a checkpoint of the simulation (state of the model and
+        attributes of its processes) is written every checkpoint_freq steps.
+        In batch mode each run writes into a subdirectory named by its index.
+    checkpoint_freq : int, optional
+        Number of steps between two checkpoints
+    resume_from : str, optional
+        A checkpoint file or directory (the latest checkpoint is used) to restart the simulation
+        from with identical results. The dataset and model must be those of the checkpointed
+        simulation. In batch mode a directory with the subdirectories of the runs,
+        runs without checkpoint start from the beginning. Not supported with outputs
+        reduced over the GUs or delta encoded.
+    cache : str or :class:`vmlab.ResultCache` object, optional
+        A directory (or cache) of outputs addressed by the content of the runs (model source,
+        setup, parameter files, input_vars). Cached outputs are returned without running
+        the model and new outputs are added. In batch mode identical runs are run only once.
+        Not used with a store, profile, memory or checkpoints.
 
     Returns
     -------
@@ -487,8 +1299,13 @@ def run(dataset, model, progress=True, geometry=False, batch=None, store=None, h
         and its values as coordinates.
     """
 
-    hooks = [xs.monitoring.ProgressBar()] + hooks if progress else hooks
+    hooks = [xs.monitoring.ProgressBar()] + hooks if progress else list(hooks)
+    monitors = _create_monitors(dataset, profile, memory)
     is_batch_run = type(batch) == tuple
+    checkpoint = (checkpoint, checkpoint_freq, resume_from)
+    # reducers and delta recorders record in hooks that do not see the steps skipped before the checkpoint
+    assert resume_from is None or not len(dataset.attrs.get('__vmlab_reducers', [])), 'reduced outputs can not be resumed from a checkpoint'
+    assert resume_from is None or not len(dataset.attrs.get('__vmlab_deltas', [])), 'delta encoded outputs can not be resumed from a checkpoint'
     sw = None
     scenes = []
     positions = []
@@ -529,10 +1346,192 @@ def run(dataset, model, progress=True, geometry=False, batch=None, store=None, h
     else:
         warnings.filterwarnings('default', 'vmlab*')
 
+    if cache is not None:
+        if store is not None or profile or memory or checkpoint[0] is not None or resume_from is not None:
+            warnings.warn('vmlab: the result cache is not used with a store, profile, memory or checkpoints')
+            cache = None
+        elif isinstance(cache, str):
+            cache = ResultCache(cache)
+
     if is_batch_run:
-        with model:
-            ds = _run_parallel(dataset, model, store, batch, sw, scenes, positions, progress, nb_proc)
+        if executor is None:
+            with Executor(min(len(batch[1]), nb_proc or mp.cpu_count())) as temporary:
+                with model:
+                    ds = _run_parallel(
+                        dataset, model, store, batch, sw, scenes, positions, progress, temporary, profile, memory, retries, errors, checkpoint, cache
+                    )
+        else:
+            with model:
+                ds = _run_parallel(
+                    dataset, model, store, batch, sw, scenes, positions, progress, executor, profile, memory, retries, errors, checkpoint, cache
+                )
+    else:
+        key = None
+        if cache is not None:
+            key = cache.key(dataset, model)
+            cached = cache.get(key)
+            if cached is not None:
+                return decode_deltas(cached)
+        checkpointer = _create_checkpointer(dataset, checkpoint)
+        if checkpointer is not None:
+            hooks.append(checkpointer)
+        ds = dataset.xsimlab.run(model=model, decoding={'mask_and_scale': False}, hooks=hooks + monitors, store=store)
+        ds = _add_monitors(ds, monitors)
+        if checkpointer is not None:
+            ds = checkpointer.merge_outputs(ds, model)
+        if key is not None:
+            ds = _cleaup_dataset(ds)
+            cache.put(key, ds)
+
+    return decode_deltas(_cleaup_dataset(ds))
+
+
+def run_iter(dataset, model, batch, progress=True, store=None, nb_proc=None, verbosity=0, profile=False, memory=False, executor=None, sink=None, retries=0, errors='raise',
+             reduce=None):
+    """Run a batch of a vmlab model and yield each run as soon as it completes
+
+    Contrary to vmlab.run in batch mode the outputs are not concatenated, hence
+    the results may be consumed or reduced incrementally at constant memory.
+    See vmlab.run for the description of the common parameters.
+
+    Parameters
+    ----------
+    dataset : :class:`xarray.Dataset` object
+        The dataset created with vmlab.create_setup
+    model : :class:`xsimlab.Model` object
+        A vmlab model
+    batch : tuple
+        A tuple of length 2 with a name and an array of dicts (input_vars)
+    sink : str or callable, optional
+        If a str, each output is appended as group '<index>' to the zarr store at this path
+        (delta encoded variables are written encoded, see vmlab.decode_deltas).
+        If a callable, it is called with the index and the output of each run.
+    reduce : dict, optional
+        Output variable -> name of a reduction method of xarray.DataArray (e.g. 'sum', 'mean', 'max')
+        or a function of the DataArray returning a scalar (picklable for process workers).
+        Each run is reduced in its worker and a dict of floats is yielded instead of its output.
+
+    Failed runs are not yielded, see the retries and errors parameters of vmlab.run.
+
+    Yields
+    ------
+    index : int
+        Index of the run in the batch
+    output : :class:`xarray.Dataset` object or dict
+        The output of the run or its reduced values
+    """
+
+    assert reduce is None or (store is None and not isinstance(sink, str)), 'reduced outputs are not written to zarr'
+
+    if verbosity == 0:
+        warnings.filterwarnings('ignore', 'vmlab*')
+    else:
+        warnings.filterwarnings('default', 'vmlab*')
+
+    batch_dim, batch_runs = batch
+    temporary = None
+    if executor is None:
+        executor = temporary = Executor(min(len(batch_runs), nb_proc or mp.cpu_count()))
+
+    try:
+        results = _iter_parallel(dataset, model, store, batch, None, [], [], progress, executor, profile, memory, retries, reduce=reduce)
+        for id, ds in results:
+            if store is not None:
+                ds = xr.open_zarr(store, consolidated=False, mask_and_scale=False).isel({batch_dim: id})
+            if isinstance(sink, str):
+                # delta encoded variables are written encoded, floats keep their NaN without a _FillValue
+                encoding = {
+                    name: {'_FillValue': None} for name, variable in ds.variables.items()
+                    if variable.dtype.kind == 'f' and '_FillValue' not in variable.attrs
+                }
+                ds.to_zarr(sink, group=str(id), mode='a', encoding=encoding)
+            if reduce is None:
+                ds = decode_deltas(ds)
+            if callable(sink):
+                sink(id, ds)
+            yield id, ds
+    except BatchError as error:
+        if errors == 'raise':
+            raise
+        warnings.warn(str(error))
+    finally:
+        if store is not None and os.path.exists(store):
+            zarr.consolidate_metadata(store)
+        if temporary is not None:
+            temporary.shutdown(wait=False)
+
+
+def fork(dataset, model, at, branches, progress=True, hooks=[], nb_proc=None, verbosity=0, errors='raise', force=False):
+    """Run a simulation until a date once and continue it in several branches with different inputs
+
+    The shared prefix of the branches is simulated only once. At the beginning of the step of
+    date 'at' the process is forked (copy-on-write, e.g. on Linux) into one worker per branch
+    that sets the input variables of its branch and simulates the rest of the period.
+    Values that processes derive from their inputs in 'initialize' (e.g. parameter tables or
+    carbon_demand__DM_fruit_max from carbon_demand__DM_fruit_0) would keep those of the prefix,
+    hence branches must differ in inputs only read during the steps (see vmlab.Brancher.check).
+
+    Parameters
+    ----------
+    dataset : :class:`xarray.Dataset` object
+        The dataset created with vmlab.create_setup
+    model : :class:`xsimlab.Model` object
+        A vmlab model
+    at : str or datetime
+        The date of the master clock at which the simulation is forked
+    branches : list or tuple
+        An array of dicts (input_vars) or like batch in vmlab.run
+        a tuple of length 2 with a name and an array of dicts (input_vars)
+    progress : boolen, optional
+        If true displays progress bars of the prefix and the branches
+    hooks : list, optional
+        One or more xarray-simlab runtime hooks
+    nb_proc : int, optional
+        Maximum number of branches simulated in parallel.
+        Defaults to minimum(number of CPU cores available, number of branches)
+    verbosity : int, optional
+        0 = no vmlab warnings, 1 = all warnings
+    errors : str, optional
+        What to do if branches failed: 'raise' a vmlab.BatchError or 'skip' them with a warning
+    force : bool, optional
+        If true branch inputs that are also read in 'initialize' (or whose reads the check
+        does not find) anyway
+
+    Returns
+    -------
+    output : :class:`xarray.Dataset` object
+        The outputs of all branches, including the prefix, concatenated along the dimension
+        'branch' (or the name of the branches) like the outputs of vmlab.run in batch mode
+    """
+
+    if verbosity == 0:
+        warnings.filterwarnings('ignore', 'vmlab*')
     else:
-        ds = dataset.xsimlab.run(model=model, decoding={'mask_and_scale': False}, hooks=hooks, store=store)
+        warnings.filterwarnings('default', 'vmlab*')
 
-    return _cleaup_dataset(ds)
+    batch = branches if isinstance(branches, tuple) else ('branch', branches)
+    days = dataset.xsimlab.master_clock_coord.values
+    step = int(np.searchsorted(days, np.datetime64(pd.Timestamp(at))))
+    assert step < days.shape[0] - 1, f'{at} is not within the simulated period'
+    clock = dataset.xsimlab.master_clock_dim
+    time_dependent = [name for name, variable in dataset.data_vars.items() if clock in variable.dims]
+    brancher = Brancher(step, batch[1], nb_proc or min(len(batch[1]), mp.cpu_count()), progress, time_dependent)
+    brancher.check(model, force)
+    monitors = _create_monitors(dataset, False, False)
+
+    try:
+        ds = dataset.xsimlab.run(model=model, decoding={'mask_and_scale': False}, hooks=list(hooks) + monitors + [brancher])
+    except BaseException as error:
+        if brancher.is_child:
+            brancher.send(error=error)
+        raise
+    if brancher.is_child:
+        brancher.send(_cleaup_dataset(_add_monitors(ds, monitors)))
+
+    if brancher.failures:
+        error = BatchError(brancher.failures)
+        if errors == 'raise':
+            raise error
+        warnings.warn(str(error))
+
+    return _concat_runs({id: decode_deltas(ds) for id, ds in brancher.outputs.items()}, batch)